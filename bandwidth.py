@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# Limits in MB/s; 0 means unlimited
+INGRESS_MBPS = float(os.getenv('BANDWIDTH_INGRESS_MBPS', '0'))
+EGRESS_MBPS = float(os.getenv('BANDWIDTH_EGRESS_MBPS', '0'))
+# Time-of-day overrides, e.g. "08:00-18:00=2/1,18:00-23:00=10/5" (ingress/egress MB/s)
+SCHEDULE = os.getenv('BANDWIDTH_SCHEDULE', '')
+# Seconds of traffic that may go through at full speed after an idle spell
+BURST_SECONDS = 1.0
+
+
+def parse_schedule(text) -> List[Tuple[int, int, float, float]]:
+    """(start minute, end minute, ingress MB/s, egress MB/s) for each window"""
+    windows = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        span, limits = item.strip().split('=')
+        start, end = (datetime.strptime(part.strip(), '%H:%M') for part in span.split('-'))
+        ingress, egress = (float(limit) for limit in limits.split('/'))
+        windows.append((start.hour * 60 + start.minute, end.hour * 60 + end.minute, ingress, egress))
+    return windows
+
+
+class TokenBucket:
+    """Byte-rate token bucket shared by any number of tasks.
+
+    Callers take tokens before (or right after) moving a chunk. The bucket
+    may go into debt by one chunk; the caller then sleeps until the debt is
+    repaid, holding the lock so waiting transfers are served in order.
+    """
+
+    def __init__(self, rate=0.0):
+        self.lock = asyncio.Lock()
+        self.rate = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Bytes per second; 0 disables the limit"""
+        if rate != self.rate:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate * BURST_SECONDS)
+
+    async def consume(self, size):
+        if not self.rate or not size:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate * BURST_SECONDS, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class BandwidthShaper:
+    """Separate ingress and egress byte-rate limits for all transfers of a process.
+
+    Limits come from ``BANDWIDTH_INGRESS_MBPS`` / ``BANDWIDTH_EGRESS_MBPS``;
+    a ``BANDWIDTH_SCHEDULE`` window that covers the current time of day
+    overrides them. Download and upload loops call ``download`` and
+    ``upload`` with each chunk's size; Telethon transfers are shaped through
+    the callbacks from ``download_progress`` and ``upload_progress``.
+    """
+
+    def __init__(self, ingress_mbps=INGRESS_MBPS, egress_mbps=EGRESS_MBPS, schedule=SCHEDULE):
+        self.default_limits = (ingress_mbps, egress_mbps)
+        self.schedule = parse_schedule(schedule)
+        self.ingress = TokenBucket()
+        self.egress = TokenBucket()
+        self.checked_minute = None
+        self.apply_schedule()
+
+    def limits_at(self, minute) -> Tuple[float, float]:
+        """(ingress, egress) MB/s in force at ``minute`` past midnight"""
+        for start, end, ingress, egress in self.schedule:
+            # A window like 22:00-06:00 wraps past midnight
+            if start <= minute < end or (start > end and (minute >= start or minute < end)):
+                return ingress, egress
+        return self.default_limits
+
+    def apply_schedule(self):
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        if minute == self.checked_minute:
+            return
+        self.checked_minute = minute
+        ingress, egress = self.limits_at(minute)
+        self.ingress.set_rate(ingress * 1_000_000)
+        self.egress.set_rate(egress * 1_000_000)
+
+    async def download(self, size):
+        self.apply_schedule()
+        await self.ingress.consume(size)
+
+    async def upload(self, size):
+        self.apply_schedule()
+        await self.egress.consume(size)
+
+    def download_progress(self, callback=None):
+        """Progress callback for Telethon downloads that charges each chunk to ingress"""
+        return self._progress(self.download, callback)
+
+    def upload_progress(self, callback=None):
+        """Progress callback for Telethon uploads that charges each chunk to egress"""
+        return self._progress(self.upload, callback)
+
+    @staticmethod
+    def _progress(consume, callback):
+        done = 0
+
+        async def progress(current, total):
+            nonlocal done
+            # Telethon awaits the callback before requesting the next chunk
+            await consume(current - done)
+            done = current
+            if callback:
+                callback(current, total)
+
+        return progress
+
+
+_shaper: Optional[BandwidthShaper] = None
+
+
+def get_shaper() -> BandwidthShaper:
+    """The process-wide shaper, so every pipeline shares the same limits"""
+    global _shaper
+    if _shaper is None:
+        _shaper = BandwidthShaper()
+    return _shaper
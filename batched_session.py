@@ -0,0 +1,190 @@
+import asyncio
+import datetime
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from telethon import utils
+from telethon.sessions import SQLiteSession
+from telethon.tl import types
+
+FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '5'))
+BUSY_TIMEOUT_MS = 10000
+
+
+class BatchedSQLiteSession(SQLiteSession):
+    """SQLite session that keeps entities and update state in memory.
+
+    The ``.session`` file keeps Telethon's own schema, so it can still be
+    opened with a plain ``TelegramClient('name', ...)``. Entity and update
+    state rows are loaded once, served from memory and written back in one
+    transaction every ``flush_interval`` seconds and on close, instead of
+    one statement per update. Login and DC changes are written straight
+    away. The file is switched to WAL mode with a busy timeout, and rows
+    missing from memory are looked up on disk, so several processes can
+    share one account's session file.
+    """
+
+    def __init__(self, session_id=None, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.entities: Dict[int, tuple] = {}
+        self.update_states: Dict[int, types.updates.State] = {}
+        self.dirty_entities = set()
+        self.dirty_states = set()
+        self.session_dirty = False
+        self.uncommitted = False
+        self._flush_task: Optional[asyncio.Task] = None
+        super().__init__(session_id)
+        # Commit schema creation or upgrade before changing the journal mode
+        self._conn.commit()
+
+        c = self._cursor()
+        try:
+            if self.filename != ':memory:':
+                c.execute('pragma journal_mode=wal')
+                c.execute('pragma synchronous=normal')
+            c.execute(f'pragma busy_timeout={BUSY_TIMEOUT_MS}')
+            for row in c.execute('select id, hash, username, phone, name, date from entities'):
+                self.entities[row[0]] = row
+            for entity_id, pts, qts, date, seq in c.execute('select id, pts, qts, date, seq from update_state'):
+                self.update_states[entity_id] = types.updates.State(
+                    pts, qts, datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc), seq, unread_count=0
+                )
+        finally:
+            c.close()
+
+    def _update_session_table(self):
+        super()._update_session_table()
+        self.session_dirty = True
+
+    def cache_file(self, md5_digest, file_size, instance):
+        super().cache_file(md5_digest, file_size, instance)
+        self.uncommitted = True
+
+    # Update state
+
+    def get_update_state(self, entity_id):
+        return self.update_states.get(entity_id)
+
+    def set_update_state(self, entity_id, state):
+        self.update_states[entity_id] = state
+        self.dirty_states.add(entity_id)
+        self._flush_if_due()
+
+    def get_update_states(self):
+        return list(self.update_states.items())
+
+    # Entities
+
+    def process_entities(self, tlo):
+        if not self.save_entities:
+            return
+        rows = self._entities_to_rows(tlo)
+        if not rows:
+            return
+        now = int(time.time())
+        for row in rows:
+            self.entities[row[0]] = row + (now,)
+            self.dirty_entities.add(row[0])
+        self._flush_if_due()
+
+    def _find(self, column, value):
+        return [row for row in self.entities.values() if row[column] == value]
+
+    def get_entity_rows_by_phone(self, phone):
+        rows = self._find(3, phone)
+        if rows:
+            return rows[0][0], rows[0][1]
+        return self._remember(super().get_entity_rows_by_phone(phone))
+
+    def get_entity_rows_by_username(self, username):
+        rows = self._find(2, username)
+        if not rows:
+            return self._remember(super().get_entity_rows_by_username(username))
+        # Usernames can move between entities; the newest row owns it
+        rows.sort(key=lambda row: row[5] or 0)
+        for row in rows[:-1]:
+            self.entities[row[0]] = row[:2] + (None,) + row[3:]
+            self.dirty_entities.add(row[0])
+        return rows[-1][0], rows[-1][1]
+
+    def get_entity_rows_by_name(self, name):
+        rows = self._find(4, name)
+        if rows:
+            return rows[0][0], rows[0][1]
+        return self._remember(super().get_entity_rows_by_name(name))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            ids = [id]
+        else:
+            ids = [utils.get_peer_id(peer(id)) for peer in (types.PeerUser, types.PeerChat, types.PeerChannel)]
+        for entity_id in ids:
+            if entity_id in self.entities:
+                return entity_id, self.entities[entity_id][1]
+        return self._remember(super().get_entity_rows_by_id(id, exact))
+
+    def _remember(self, result):
+        """Cache a row another process wrote to the file since we loaded it"""
+        if result:
+            row = self._execute('select id, hash, username, phone, name, date from entities where id = ?', result[0])
+            if row:
+                self.entities[row[0]] = row
+        return result
+
+    # Flushing
+
+    def _flush_if_due(self):
+        if self._flush_task is None:
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._autoflush())
+            except RuntimeError:
+                pass
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    async def _autoflush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write all changed rows in one transaction"""
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not (self.dirty_entities or self.dirty_states or self.session_dirty or self.uncommitted):
+                return
+            entity_rows = [self.entities[entity_id] for entity_id in self.dirty_entities]
+            state_rows = [
+                (entity_id, state.pts, state.qts, state.date.timestamp(), state.seq)
+                for entity_id, state in ((i, self.update_states[i]) for i in self.dirty_states)
+            ]
+            c = self._cursor()
+            try:
+                c.executemany('insert or replace into entities values (?,?,?,?,?,?)', entity_rows)
+                c.executemany('insert or replace into update_state values (?,?,?,?,?)', state_rows)
+                self._conn.commit()
+            finally:
+                c.close()
+            self.dirty_entities.clear()
+            self.dirty_states.clear()
+            self.session_dirty = False
+            self.uncommitted = False
+
+    def save(self):
+        # Telethon saves after every update batch; only auth changes are urgent
+        if self.session_dirty:
+            self.flush()
+        elif self._conn is not None:
+            self._flush_if_due()
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._conn is not None:
+            self.flush()
+        super().close()
@@ -0,0 +1,166 @@
+"""Keep blocking disk and CPU work off the event loop, and catch what does not.
+
+``run_blocking`` runs a function in a shared thread pool so Telegram
+connections keep being served while it works. ``JsonSaver`` writes a JSON
+document through that pool, one write at a time, folding saves requested
+during a write into the next one.
+
+``start_lag_monitor`` watches the loop from a separate thread. When the
+loop has not run for ``LOOP_LAG_THRESHOLD_MS`` (default 250, 0 disables)
+it prints the stack of the code that is blocking it:
+
+    ⚠ Event loop blocked for 412 ms in:
+      File "pdfscrapper.py", line 140, in get_file_hash
+      ...
+"""
+import asyncio
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from instrumentation import timer
+
+IO_WORKERS = int(os.getenv('IO_WORKERS', '4'))
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '250')) / 1000
+LOOP_LAG_INTERVAL = 0.05
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The process-wide pool for blocking work"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(IO_WORKERS, thread_name_prefix='blocking-io')
+    return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run ``func(*args, **kwargs)`` in the blocking I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def ainput(prompt=''):
+    """``input`` that leaves the event loop running while it waits"""
+    return await run_blocking(input, prompt)
+
+
+class JsonSaver:
+    """Atomically write a JSON document from the blocking I/O pool.
+
+    ``snapshot`` returns the data to write and is called on the event loop,
+    so it must copy anything the loop may change while the write runs.
+    Saves requested while a write is running are folded into one more
+    write of the latest snapshot. Outside an event loop ``save`` writes
+    directly.
+    """
+
+    def __init__(self, path, snapshot: Callable[[], object], stage='save_history', indent=None):
+        self.path = Path(path)
+        self.snapshot = snapshot
+        self.stage = stage
+        self.indent = indent
+        self.pending = False
+        self.task: Optional[asyncio.Task] = None
+
+    def write(self, data):
+        with timer(self.stage):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.path.with_name(self.path.name + '.tmp')
+            tmp_file.write_text(json.dumps(data, indent=self.indent))
+            os.replace(tmp_file, self.path)
+
+    def save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write(self.snapshot())
+            return
+        self.pending = True
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self.pending:
+            self.pending = False
+            try:
+                await run_blocking(self.write, self.snapshot())
+            except Exception as e:
+                print(f"Error saving {self.path}: {e}")
+
+    async def flush(self):
+        """Wait until every requested save has been written"""
+        if self.task is not None:
+            await asyncio.shield(self.task)
+
+
+class LoopLagMonitor:
+    """Report event loop stalls with the stack of the code causing them.
+
+    A task on the loop stamps a heartbeat every ``LOOP_LAG_INTERVAL``
+    seconds. A daemon thread checks the stamp; once it is older than the
+    threshold, the loop thread is stuck in whatever it is running right
+    now, so that frame's stack is printed, once per stall.
+    """
+
+    def __init__(self, threshold=LOOP_LAG_THRESHOLD, interval=LOOP_LAG_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeat = time.monotonic()
+        self.loop_thread = None
+        self.task = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, name='loop-lag-monitor', daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+
+    async def _beat(self):
+        try:
+            while True:
+                self.heartbeat = time.monotonic()
+                await asyncio.sleep(self.interval)
+        finally:
+            # The loop is shutting down; a missing heartbeat is not a stall
+            self.stopped.set()
+
+    def _watch(self):
+        reported = None
+        while not self.stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            lag = time.monotonic() - heartbeat - self.interval
+            if lag < self.threshold or heartbeat == reported:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                return
+            reported = heartbeat
+            stack = ''.join(traceback.format_stack(frame))
+            print(f"\n⚠ Event loop blocked for {lag * 1000:.0f} ms in:\n{stack}", file=sys.stderr)
+
+
+_monitor: Optional[LoopLagMonitor] = None
+
+
+def start_lag_monitor() -> Optional[LoopLagMonitor]:
+    """Start the process-wide loop lag monitor from inside the running loop"""
+    global _monitor
+    if LOOP_LAG_THRESHOLD > 0 and (_monitor is None or _monitor.stopped.is_set()):
+        _monitor = LoopLagMonitor()
+        _monitor.start()
+    return _monitor
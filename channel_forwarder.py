@@ -10,15 +10,43 @@ from humanize import naturalsize
 from pathlib import Path
 import argparse
 import sys
+from contextlib import asynccontextmanager
 from rich.console import Console
 from rich.prompt import Prompt
-from rich import print as rprint
+from rich import print as rich_print
+from bandwidth import get_shaper
+from batched_session import BatchedSQLiteSession
+from blocking_io import JsonSaver, ainput, run_blocking, start_lag_monitor
+from dc_pool import get_pool
+from instrumentation import timed, timed_iter, timer
+from spool import get_spool
+from history_reader import iter_history
+from takeout import BACKFILL_TAKEOUT
+from transfer_plan import TransferPlan, requests_per_second
+from upload_engine import UploadEngine
 
 # Load environment variables
 load_dotenv()
 
+# Console output is one of the timed stages
+rprint = timed('console')(rich_print)
+
+# Media at least this large goes to the bulk lane so it cannot hold up text and small media
+BULK_LANE_THRESHOLD = int(os.getenv('FORWARD_BULK_THRESHOLD_MB', '20')) * 1024 * 1024
+FAST_LANE_CONCURRENCY = int(os.getenv('FORWARD_FAST_CONCURRENCY', '4'))
+BULK_LANE_CONCURRENCY = int(os.getenv('FORWARD_BULK_CONCURRENCY', '1'))
+# How many messages may be in flight behind the oldest unfinished one
+FORWARD_WINDOW = int(os.getenv('FORWARD_WINDOW', '32'))
+# Let text and small media overtake large files instead of keeping per-target order
+ORDER_RELAXED = os.getenv('FORWARD_ORDER_RELAXED', '') not in ('', '0')
+# Sources and targets for --serve, re-read whenever the file changes
+CONFIG_FILE = os.getenv('FORWARD_CONFIG_FILE', 'forwarder.json')
+CONFIG_CHECK_INTERVAL = float(os.getenv('FORWARD_CONFIG_CHECK_INTERVAL', '5'))
+# How often a serving pipeline asks its source for new messages
+POLL_INTERVAL = float(os.getenv('FORWARD_POLL_INTERVAL', '30'))
+
 class TelegramForwarder:
-    def __init__(self):
+    def __init__(self, client=None, rate_limiter=None, entity_cache=None):
         self.api_id = int(os.getenv('TELEGRAM_API_ID'))
         self.api_hash = os.getenv('TELEGRAM_API_HASH')
         self.source_channels = os.getenv('SOURCE_CHANNELS', '').split(',')
@@ -28,11 +56,30 @@ class TelegramForwarder:
         self.target_channels = [name.strip() for name in self.target_channels if name.strip()]
         
         self.history_file = Path('forward_history.json')
-        self.client = TelegramClient('forwarder_session', self.api_id, self.api_hash)
+        self.client = client or TelegramClient(BatchedSQLiteSession('forwarder_session'), self.api_id, self.api_hash)
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
+        self.engine = UploadEngine(self.client)
+        self.spool = get_spool()
+        self.shaper = get_shaper()
+        self.dc_pool = get_pool(self.client)
+        # Read backfill history through a takeout session
+        self.takeout = BACKFILL_TAKEOUT
+        self.lanes = {
+            'fast': asyncio.Semaphore(FAST_LANE_CONCURRENCY),
+            'bulk': asyncio.Semaphore(BULK_LANE_CONCURRENCY)
+        }
         self.forward_history = self.load_history()
+        self.history_saver = JsonSaver(self.history_file, lambda: dict(self.forward_history), indent=2)
         
         self.sources = []
         self.targets = []
+        # Resolved entities by configured name, kept in step with the lists above
+        self.source_entities = {}
+        self.target_entities = {}
+        # Source id -> (pipeline task, stop event) while serving
+        self.pipelines = {}
+        self.resolving = {}
         
         self.stats = {
             'forwarded': 0,
@@ -63,15 +110,12 @@ class TelegramForwarder:
             return {}
 
     def save_history(self):
-        """Save forwarding history to file"""
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.forward_history, f, indent=2)
-        except Exception as e:
-            rprint(f"[red]Error saving history: {str(e)}[/red]")
+        """Save forwarding history to file, off the event loop"""
+        self.history_saver.save()
 
     async def initialize_channels(self):
         """Initialize source and target channels"""
+        self.dc_pool.start()
         print("\nInitializing channels...")
         
         # Initialize source channels
@@ -81,6 +125,7 @@ class TelegramForwarder:
                 entity = await self._get_entity_from_name(channel)
                 if isinstance(entity, (Channel, Chat)):
                     self.sources.append(entity)
+                    self.source_entities[channel] = entity
                     print(f"✓ Added source: {entity.title}")
             except Exception as e:
                 print(f"✗ Failed to add source {channel}: {str(e)}")
@@ -92,12 +137,15 @@ class TelegramForwarder:
                 entity = await self._get_entity_from_name(channel)
                 if isinstance(entity, (Channel, Chat)):
                     self.targets.append(entity)
+                    self.target_entities[channel] = entity
                     print(f"✓ Added target: {entity.title}")
             except Exception as e:
                 print(f"✗ Failed to add target {channel}: {str(e)}")
 
     async def _get_entity_from_name(self, channel_name: str):
         """Helper to get entity from name or ID"""
+        if self.entity_cache:
+            return await self.entity_cache.get(channel_name)
         try:
             if str(channel_name).replace('-', '').isdigit():
                 clean_id = str(channel_name).replace('-100', '')
@@ -122,27 +170,38 @@ class TelegramForwarder:
         try:
             # Debug the media download
             rprint(f"[cyan]Attempting to download media for message {message.id}[/cyan]")
-            temp_path = Path(f"temp_{message.id}")
-            file_path = await self.client.download_media(message, str(temp_path))
-            
-            if file_path:
-                rprint(f"[green]Successfully downloaded media to {file_path}[/green]")
-                await self.client.send_file(
-                    target_channel,
-                    file_path,
-                    caption=caption,
-                    force_document=True
-                )
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    rprint(f"[green]Cleaned up temporary file {file_path}[/green]")
-            else:
-                rprint(f"[red]Failed to download media for message {message.id}[/red]")
+            # The staging directory is removed with the file when the block ends
+            async with self.spool.stage(message.file.size if message.file else 0) as staging:
+                temp_path = staging / f"temp_{message.id}"
+                with timer('download_media', str(message.chat_id)):
+                    file_path = await self.client.download_media(
+                        message, str(temp_path),
+                        progress_callback=self.shaper.download_progress(self.dc_pool.first_byte_progress(message))
+                    )
+
+                if file_path:
+                    rprint(f"[green]Successfully downloaded media to {file_path}[/green]")
+                    await self.engine.send_file(
+                        target_channel,
+                        file_path,
+                        caption=caption,
+                        force_document=True,
+                        progress_callback=self._print_upload_progress
+                    )
+                else:
+                    rprint(f"[red]Failed to download media for message {message.id}[/red]")
                 
         except Exception as e:
             rprint(f"[red]Error handling media message {message.id}: {type(e).__name__}: {str(e)}[/red]")
             raise
 
+    def _print_upload_progress(self, sent, total, speed):
+        """Show upload progress and speed on a single console line"""
+        self.console.print(
+            f"[cyan]Uploading: {naturalsize(sent)}/{naturalsize(total)} ({naturalsize(speed)}/s)[/cyan]",
+            end='\r'
+        )
+
     async def _update_history(self, message_id, source_channel, target_id):
         """Update forwarding history"""
         if message_id not in self.history:
@@ -156,6 +215,9 @@ class TelegramForwarder:
 
     async def _wait_for_rate_limit(self):
         """Ensure we don't exceed Telegram's rate limits"""
+        if self.rate_limiter:
+            await self.rate_limiter.wait()
+            return
         try:
             async with self.request_lock:
                 current_time = time.time()
@@ -183,9 +245,68 @@ class TelegramForwarder:
             rprint(f"[red]Rate limit error: {str(e)}[/red]")
             raise
 
-    async def forward_message(self, source_channel, target_channel, message):
-        """Re-send message content instead of forwarding for protected chats"""
+    @staticmethod
+    def lane_for(message) -> str:
+        """'bulk' for large media, 'fast' for text and small media"""
+        size = message.file.size if message.media and message.file else 0
+        return 'bulk' if (size or 0) >= BULK_LANE_THRESHOLD else 'fast'
+
+    @staticmethod
+    async def _wait_turn(previous):
+        """Wait until the previous message to the same target has been sent"""
+        if previous is not None:
+            # Unlike await, asyncio.wait does not cancel the marker if this send is cancelled
+            await asyncio.wait([previous])
+
+    @asynccontextmanager
+    async def staged_media(self, message):
+        """Download a message's media once and upload it, yielding the staged path.
+
+        Runs in the message's lane under a spool reservation; both are
+        released once the upload handle exists. The staged file stays until
+        the block ends, outside the quota, so every target can be sent the
+        cached handle and the engine can upload it again if Telegram drops
+        it. Yields None if the download failed.
+        """
+        with self.spool.directory() as staging:
+            async with self.lanes[self.lane_for(message)]:
+                async with self.spool.reservation(message.file.size if message.file else 0):
+                    temp_path = staging / f"temp_{message.id}"
+                    with timer('download_media', str(message.chat_id)):
+                        file_path = await self.client.download_media(
+                            message, str(temp_path),
+                            progress_callback=self.shaper.download_progress(
+                                self.dc_pool.first_byte_progress(message)
+                            )
+                        )
+                    if file_path:
+                        await self.engine.upload(file_path, progress_callback=self._print_upload_progress)
+                    else:
+                        rprint(f"[red]Failed to download media for message {message.id}[/red]")
+            # Waiting for earlier messages to each target holds no quota, so it cannot block their staging
+            yield file_path
+
+    async def _send_media(self, target_channel, message, file_path, after):
+        """Send a staged media file, after the previous message to this target"""
+        caption = message.text if hasattr(message, 'text') else message.caption if hasattr(message, 'caption') else None
+        await self._wait_turn(after)
+        rprint(f"[cyan]Sending media to {target_channel.title}[/cyan]")
+        # The engine uploads the file again if Telegram dropped the cached handle
+        return await self.engine.send_file(
+            target_channel, file_path, caption=caption, force_document=True,
+            progress_callback=self._print_upload_progress
+        )
+
+    async def forward_message(self, source_channel, target_channel, message, after=None, file_path=None):
+        """Re-send message content instead of forwarding for protected chats.
+
+        Media is sent from ``file_path`` when the caller has staged it with
+        ``staged_media``, otherwise downloaded here. The final send waits
+        for ``after`` (the previous message's send to this target) so the
+        target sees messages in order.
+        """
         await self._wait_for_rate_limit()
+        lane = self.lanes[self.lane_for(message)]
         try:
             message_id = f"{source_channel.id}_{message.id}"
             target_id = str(target_channel.id)
@@ -196,28 +317,20 @@ class TelegramForwarder:
                 # Instead of forwarding, we'll copy the content
                 if hasattr(message, 'media') and message.media:
                     rprint(f"[cyan]Copying media message {message.id}[/cyan]")
-                    temp_path = Path(f"temp_{message.id}")
-                    file_path = await self.client.download_media(message, str(temp_path))
-                    
                     if file_path:
-                        caption = message.text if hasattr(message, 'text') else message.caption if hasattr(message, 'caption') else None
-                        rprint(f"[cyan]Uploading media to {target_channel.title}[/cyan]")
-                        sent_message = await self.client.send_file(
-                            target_channel,
-                            file_path,
-                            caption=caption,
-                            force_document=True
-                        )
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            rprint(f"[green]Media transferred successfully[/green]")
+                        sent_message = await self._send_media(target_channel, message, file_path, after)
                     else:
-                        rprint(f"[red]Failed to download media[/red]")
-                        return False
+                        async with self.staged_media(message) as staged_path:
+                            if not staged_path:
+                                return False
+                            sent_message = await self._send_media(target_channel, message, staged_path, after)
+                    rprint(f"[green]Media transferred successfully[/green]")
                         
                 elif hasattr(message, 'text') and message.text:
                     rprint(f"[cyan]Copying text message to {target_channel.title}[/cyan]")
-                    sent_message = await self.client.send_message(target_channel, message.text)
+                    await self._wait_turn(after)
+                    async with lane:
+                        sent_message = await self.client.send_message(target_channel, message.text)
                     if not sent_message:
                         rprint(f"[red]Failed to send text message[/red]")
                         return False
@@ -250,13 +363,79 @@ class TelegramForwarder:
             rprint(f"[red]Error processing message: {type(e).__name__}: {str(e)}[/red]")
             return False
 
-    async def forward_messages(self, source, limit=None, offset_id=0):
-        """Forward messages from source to targets"""
+    def wants_record(self, source_id, record) -> bool:
+        """Whether a message has content and has not been forwarded yet"""
+        return f"{source_id}_{record['id']}" not in self.forward_history and bool(record['media'] or record['caption'])
+
+    async def plan_forward(self, source, limit=None, offset_id=0, mirror=None) -> TransferPlan:
+        """Dry run: what forward_messages would copy, without downloading or sending"""
+        source_id = str(source.id)
+        plan = TransferPlan(
+            'forward', source.id, source.title,
+            targets=len(self.targets),
+            # Media is downloaded and uploaded once, whatever the number of targets
+            copies=1,
+            rate_limit=requests_per_second(self.rate_limiter) if self.rate_limiter else self.RATE_LIMIT / self.RATE_WINDOW,
+            delay_per_item=0.5 * len(self.targets)
+        )
+        await plan.scan(
+            self.client, source, lambda record: self.wants_record(source_id, record),
+            mirror, limit=limit, offset_id=offset_id, takeout=self.takeout
+        )
+        plan.save()
+        plan.print_report()
+        return plan
+
+    async def forward_messages(self, source, limit=None, offset_id=0, mirror=None, dry_run=False, plan=None,
+                               min_id=0, stop=None, takeout=None):
+        """Forward messages from source to targets.
+
+        Plans from ``mirror`` (a HistoryMirror) if given. With ``dry_run``
+        only builds and saves a TransferPlan; with ``plan`` copies exactly
+        the planned messages. With ``min_id`` only newer messages are
+        copied, oldest first. Once ``stop`` (an asyncio.Event) is set no
+        further messages are started and those in flight are finished.
+        ``takeout`` overrides whether history is read through a takeout
+        session.
+
+        Up to ``FORWARD_WINDOW`` messages are copied at once: large media in
+        the bulk lane, text and small media in the fast lane, so a large
+        file does not stall the transfers behind it. Each target still
+        receives messages in order unless ``FORWARD_ORDER_RELAXED`` is set,
+        in which case fast-lane messages are sent as soon as they are ready.
+        """
+        if dry_run:
+            return await self.plan_forward(source, limit, offset_id, mirror)
+        if takeout is None:
+            takeout = self.takeout
+        in_flight = set()
+        message_count = 0
         try:
             source_id = str(source.id)
-            message_count = 0
             
-            async for message in self.client.iter_messages(source, limit=limit, offset_id=offset_id):
+            if plan:
+                rprint(f"[cyan]Running saved plan: {len(plan.items)} messages[/cyan]")
+                messages = iter_history(self.client, source, takeout, ids=plan.ids)
+            elif mirror:
+                message_ids = mirror.channel(source.id).pending_ids(
+                    lambda record: self.wants_record(source_id, record),
+                    max_id=offset_id - 1 if offset_id else None
+                )[::-1][:limit]
+                rprint(f"[cyan]Planned {len(message_ids)} messages from the local mirror[/cyan]")
+                messages = iter_history(self.client, source, takeout, ids=message_ids)
+            else:
+                messages = iter_history(
+                    self.client, source, takeout,
+                    limit=limit, offset_id=offset_id, min_id=min_id, reverse=bool(min_id)
+                )
+            # Each target's last send marker; the next message to it sends after that one
+            last_sent = {}
+            async for message in timed_iter(messages, 'history_page', source_id):
+                # Messages deleted since they were mirrored come back as None
+                if message is None:
+                    continue
+                if stop is not None and stop.is_set():
+                    break
                 try:
                     await self._wait_for_rate_limit()  # Rate limit check
                     
@@ -266,47 +445,250 @@ class TelegramForwarder:
                         self.stats['skipped'] += 1
                         continue
 
-                    # Process message for each target
-                    for target in self.targets:
-                        success = await self.forward_message(source, target, message)
-                        if success:
-                            self.stats['forwarded'] += 1
-                        else:
-                            self.stats['failed'] += 1
-                        await asyncio.sleep(0.5)  # Small delay between forwards
-                    
-                    # Update history
-                    self.forward_history[message_hash] = {
-                        'timestamp': datetime.now().isoformat(),
-                        'source': source.title,
-                        'message_id': message.id
-                    }
-                    self.save_history()
-                    
-                    # Update stats
-                    self.stats['messages_in_window'] += 1
-                    self.stats['last_message_id'] = message.id
+                    # Targets added or removed later only affect messages started after the change
+                    targets = list(self.targets)
+                    # Relaxed order only lets fast-lane messages skip ahead; large media keeps its place
+                    in_order = not ORDER_RELAXED or self.lane_for(message) == 'bulk'
+                    turns = {}
+                    for target in targets:
+                        sent = asyncio.get_running_loop().create_future()
+                        turns[target.id] = (last_sent.get(target.id) if in_order else None, sent)
+                        last_sent[target.id] = sent
+                    task = asyncio.create_task(self._forward_to_targets(source, message, targets, turns))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
                     message_count += 1
-                    
-                    # Print progress every 10 seconds
-                    current_time = time.time()
-                    if current_time - self.stats['last_print'] >= 10:
-                        await self.print_progress()
-                        self.stats['messages_in_window'] = 0
-                        self.stats['last_print'] = current_time
+                    if len(in_flight) >= FORWARD_WINDOW:
+                        await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
 
                 except Exception as e:
                     rprint(f"[red]Error processing message {message.id}: {str(e)}[/red]")
                     self.stats['failed'] += 1
                     continue
 
+            await asyncio.gather(*in_flight)
+
         except asyncio.CancelledError:
             rprint("\n[yellow]Forwarding cancelled by user[/yellow]")
+            for task in in_flight:
+                task.cancel()
             raise
         except Exception as e:
             rprint(f"[red]Error in forward_messages: {str(e)}[/red]")
         finally:
-            await self.print_progress()
+            # Serving pipelines poll often; only report polls that found something
+            if message_count or stop is None:
+                await self.print_progress()
+
+    async def _forward_to_targets(self, source, message, targets, turns):
+        """Copy one message to every target, marking each target's send as done"""
+        try:
+            if message.media:
+                # Media is downloaded and uploaded once, then sent to every target
+                async with self.staged_media(message) as file_path:
+                    await self._send_to_targets(source, message, targets, turns, file_path)
+            else:
+                await self._send_to_targets(source, message, targets, turns)
+            
+            # Update history
+            self.forward_history[f"{source.id}_{message.id}"] = {
+                'timestamp': datetime.now().isoformat(),
+                'source': source.title,
+                'message_id': message.id
+            }
+            self.save_history()
+            
+            # Update stats
+            self.stats['messages_in_window'] += 1
+            self.stats['last_message_id'] = message.id
+            
+            # Print progress every 10 seconds
+            current_time = time.time()
+            if current_time - self.stats['last_print'] >= 10:
+                self.stats['last_print'] = current_time
+                await self.print_progress()
+                self.stats['messages_in_window'] = 0
+
+        except Exception as e:
+            rprint(f"[red]Error processing message {message.id}: {str(e)}[/red]")
+            self.stats['failed'] += 1
+        finally:
+            # Targets not reached because of an error must not hold up later messages
+            for _, sent in turns.values():
+                if not sent.done():
+                    sent.set_result(None)
+
+    async def _send_to_targets(self, source, message, targets, turns, file_path=None):
+        for target in targets:
+            after, sent = turns[target.id]
+            try:
+                if message.media and not file_path:
+                    success = False  # The download already failed
+                else:
+                    success = await self.forward_message(source, target, message, after=after, file_path=file_path)
+            finally:
+                # Later messages to this target may go now, whatever happened to this one
+                sent.set_result(None)
+            if success:
+                self.stats['forwarded'] += 1
+            else:
+                self.stats['failed'] += 1
+            await asyncio.sleep(0.5)  # Small delay between forwards
+
+    async def run_saved_plans(self):
+        """Forward what the last dry run planned for each source"""
+        for source in self.sources:
+            plan = TransferPlan.load('forward', source.id)
+            if plan:
+                await self.forward_messages(source, plan=plan)
+            else:
+                rprint(f"[yellow]No saved plan for {source.title}[/yellow]")
+
+    def get_resume_offset(self, source):
+        """Highest message id already forwarded from ``source``"""
+        prefix = f"{source.id}_"
+        return max((int(k[len(prefix):]) for k in self.forward_history.keys() 
+                    if k.startswith(prefix)), default=0)
+
+    def read_config(self, path):
+        """(sources, targets) from a JSON config file, or None if it is missing or unreadable"""
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+            return tuple(
+                [str(name).strip() for name in config.get(key, []) if str(name).strip()]
+                for key in ('sources', 'targets')
+            )
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, AttributeError) as e:
+            rprint(f"[red]Error reading {path}: {str(e)}; keeping the current channels[/red]")
+            return None
+
+    def _sync_channel_lists(self):
+        self.sources = [self.source_entities[name] for name in self.source_channels if name in self.source_entities]
+        self.targets = [self.target_entities[name] for name in self.target_channels if name in self.target_entities]
+
+    def apply_config(self, source_names, target_names):
+        """Match the running pipelines and targets to the configured names.
+
+        Removed targets get no new messages; removed sources drain their
+        messages in flight. New channels are resolved in the background and
+        join once resolved. Channels that stay configured are not touched.
+        """
+        self.source_channels, self.target_channels = source_names, target_names
+        for name in [name for name in self.target_entities if name not in target_names]:
+            rprint(f"[yellow]- Removed target: {self.target_entities.pop(name).title}[/yellow]")
+        for name in [name for name in self.source_entities if name not in source_names]:
+            self.stop_pipeline(self.source_entities.pop(name))
+        self._sync_channel_lists()
+        for name in target_names:
+            self._resolve_in_background('target', name)
+        for name in source_names:
+            self._resolve_in_background('source', name)
+
+    def _resolve_in_background(self, kind, name):
+        entities = self.source_entities if kind == 'source' else self.target_entities
+        if name in entities or (kind, name) in self.resolving:
+            return
+        task = asyncio.create_task(self._add_channel(kind, name))
+        self.resolving[(kind, name)] = task
+        task.add_done_callback(lambda _: self.resolving.pop((kind, name), None))
+
+    async def _add_channel(self, kind, name):
+        """Resolve a newly configured channel and put it to work"""
+        try:
+            entity = await self._get_entity_from_name(name)
+        except Exception as e:
+            rprint(f"[red]✗ Failed to add {kind} {name}: {str(e)}[/red]")
+            return
+        if not isinstance(entity, (Channel, Chat)):
+            rprint(f"[red]✗ Failed to add {kind} {name}: not a channel or group[/red]")
+            return
+        # Removed again while it was being resolved
+        if name not in (self.source_channels if kind == 'source' else self.target_channels):
+            return
+        if kind == 'target':
+            self.target_entities[name] = entity
+            self._sync_channel_lists()
+            rprint(f"[green]✓ Added target: {entity.title}[/green]")
+            return
+        self.source_entities[name] = entity
+        self._sync_channel_lists()
+        rprint(f"[green]✓ Added source: {entity.title}[/green]")
+        await self.start_pipeline(entity)
+
+    async def start_pipeline(self, source):
+        previous = self.pipelines.get(source.id)
+        if previous:
+            # Re-added while its old pipeline drains; take over once that one is done
+            await asyncio.wait([previous[0]])
+            if source.id in self.pipelines or source not in self.sources:
+                return
+        stop = asyncio.Event()
+        self.pipelines[source.id] = (asyncio.create_task(self.run_pipeline(source, stop)), stop)
+
+    def stop_pipeline(self, source):
+        """Let ``source``'s pipeline finish the messages in flight and end"""
+        pipeline = self.pipelines.get(source.id)
+        if pipeline and not pipeline[1].is_set():
+            pipeline[1].set()
+            rprint(f"[yellow]- Removed source: {source.title}; finishing messages in flight[/yellow]")
+
+    async def run_pipeline(self, source, stop):
+        """Forward ``source`` until ``stop`` is set: its history first, then new messages as they arrive.
+
+        The history pass resumes below the newest message already forwarded;
+        messages in the forward history are skipped, so a pass interrupted
+        during backfill picks up the rest of the older backlog.
+        """
+        try:
+            await self.forward_messages(source, offset_id=self.get_resume_offset(source), stop=stop)
+            while not stop.is_set():
+                # Short polls for new messages are not worth a takeout session
+                await self.forward_messages(source, min_id=self.get_resume_offset(source), stop=stop, takeout=False)
+                try:
+                    await asyncio.wait_for(stop.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            rprint(f"[yellow]Stopped forwarding from {source.title}[/yellow]")
+        finally:
+            if self.pipelines.get(source.id, (None,))[0] is asyncio.current_task():
+                del self.pipelines[source.id]
+
+    async def watch_config(self, path=CONFIG_FILE):
+        """Apply the config file whenever it is saved"""
+        async def stamp():
+            try:
+                return (await run_blocking(os.stat, path)).st_mtime_ns
+            except FileNotFoundError:
+                return None
+
+        applied = await stamp()
+        while True:
+            await asyncio.sleep(CONFIG_CHECK_INTERVAL)
+            current = await stamp()
+            if current is None or current == applied:
+                continue
+            applied = current
+            config = await run_blocking(self.read_config, path)
+            if config:
+                rprint(f"[cyan]Reloading channels from {path}[/cyan]")
+                self.apply_config(*config)
+
+    async def serve(self, config_file=CONFIG_FILE):
+        """Forward every source continuously, picking up channel changes in ``config_file``"""
+        for source in self.sources:
+            await self.start_pipeline(source)
+        rprint(f"[cyan]Forwarding from {len(self.sources)} sources; "
+               f"edit {config_file} to add or remove channels[/cyan]")
+        try:
+            await self.watch_config(config_file)
+        finally:
+            for task in list(self.resolving.values()):
+                task.cancel()
+            for task, _ in list(self.pipelines.values()):
+                task.cancel()
 
     async def print_progress(self):
         """Print forwarding progress"""
@@ -381,9 +763,11 @@ class TelegramForwarder:
             rprint("2. Resume forwarding")
             rprint("3. Show current status")
             rprint("4. Test forward single message")
-            rprint("5. Exit")
+            rprint("5. Plan forwarding (dry run)")
+            rprint("6. Run saved plans")
+            rprint("7. Exit")
             
-            choice = Prompt.ask("\nEnter your choice", choices=["1", "2", "3", "4", "5"])
+            choice = await run_blocking(Prompt.ask, "\nEnter your choice", choices=["1", "2", "3", "4", "5", "6", "7"])
             
             if choice == "4":
                 try:
@@ -391,14 +775,14 @@ class TelegramForwarder:
                     
                     if not self.sources or not self.targets:
                         rprint("[red]Please configure both source and target channels![/red]")
-                        input("\nPress Enter to continue...")
+                        await ainput("\nPress Enter to continue...")
                         continue
                     
                     source = self.sources[0]
                     messages = await self.client.get_messages(source, limit=1)
                     if not messages:
                         rprint("[red]No messages found in source channel![/red]")
-                        input("\nPress Enter to continue...")
+                        await ainput("\nPress Enter to continue...")
                         continue
                         
                     message = messages[0]
@@ -412,34 +796,61 @@ class TelegramForwarder:
                         else:
                             rprint(f"[red]Failed to copy to {target.title}[/red]")
                     
-                    input("\nTest complete. Press Enter to continue...")
+                    await ainput("\nTest complete. Press Enter to continue...")
                     
                 except Exception as e:
                     rprint(f"[red]Test failed: {type(e).__name__}: {str(e)}[/red]")
-                    input("\nPress Enter to continue...")
+                    await ainput("\nPress Enter to continue...")
             
-            elif choice == "5":
+            elif choice == "7":
                 rprint("[yellow]Exiting...[/yellow]")
                 break
+            elif choice == "5":
+                for source in self.sources:
+                    await self.forward_messages(source, offset_id=self.get_resume_offset(source), dry_run=True)
+                await ainput("\nPress Enter to continue...")
+            elif choice == "6":
+                await self.run_saved_plans()
             elif choice == "1":
                 for source in self.sources:
                     await self.forward_messages(source)
             elif choice == "2":
                 for source in self.sources:
-                    last_id = max((int(k.split('_')[1]) for k in self.forward_history.keys() 
-                                 if k.startswith(str(source.id))), default=0)
-                    await self.forward_messages(source, offset_id=last_id)
+                    await self.forward_messages(source, offset_id=self.get_resume_offset(source))
             elif choice == "3":
                 await self.verify_permissions()
-                input("\nPress Enter to continue...")
+                await ainput("\nPress Enter to continue...")
 
 async def main():
+    parser = argparse.ArgumentParser(description='Telegram Channel Forwarder')
+    parser.add_argument('--dry-run', action='store_true', help='Plan forwarding from the resume point and exit')
+    parser.add_argument('--run-plan', action='store_true', help='Forward the saved plans and exit')
+    parser.add_argument('--takeout', action='store_true', help='Read history through a takeout session')
+    parser.add_argument('--serve', action='store_true',
+                        help='Keep forwarding new messages, reloading sources and targets from the config file')
+    parser.add_argument('--config', default=CONFIG_FILE, help=f'Channel config for --serve (default {CONFIG_FILE})')
+    args = parser.parse_args()
+
     forwarder = TelegramForwarder()
+    forwarder.takeout = forwarder.takeout or args.takeout
+    if args.serve:
+        config = forwarder.read_config(args.config)
+        if config:
+            forwarder.source_channels, forwarder.target_channels = config
+    start_lag_monitor()
     
     try:
         await forwarder.client.start()
         await forwarder.initialize_channels()
-        await forwarder.interactive_menu()
+        if args.dry_run:
+            for source in forwarder.sources:
+                await forwarder.forward_messages(source, offset_id=forwarder.get_resume_offset(source), dry_run=True)
+        elif args.run_plan:
+            await forwarder.run_saved_plans()
+        elif args.serve:
+            await forwarder.serve(args.config)
+        else:
+            await forwarder.interactive_menu()
     except asyncio.CancelledError:
         rprint("\n[yellow]Operation cancelled by user[/yellow]")
     except KeyboardInterrupt:
@@ -449,6 +860,7 @@ async def main():
     finally:
         # Save any pending progress
         forwarder.save_history()
+        await forwarder.history_saver.flush()
         await forwarder.client.disconnect()
         rprint("[green]Session saved and cleaned up[/green]")
 
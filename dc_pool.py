@@ -0,0 +1,290 @@
+"""Pool of exported-auth senders per data center for media transfers.
+
+Files stored on another data center (DC) than the account's home DC are
+fetched over a separate connection, authorized by exporting the login to
+that DC. Telethon opens one such sender per DC when a transfer first needs
+it, under a lock shared by every DC, and drops it after a minute without
+transfers, so bursts of downloads keep paying for the connection setup and
+every transfer to a DC shares one connection.
+
+``DcSenderPool`` takes over the client's borrow and return hooks:
+
+- each DC gets up to ``DC_POOL_MAX_SENDERS`` senders (default 3); another
+  one is opened once every sender carries ``DC_POOL_BORROWS_PER_SENDER``
+  transfers (default 2)
+- DCs used in the last ``DC_POOL_PREWARM_DAYS`` days (default 7) are
+  connected at startup, and one sender per DC in use is kept for the run
+- every ``DC_POOL_HEALTH_INTERVAL`` seconds (default 30) idle senders are
+  pinged; those that fail are replaced and extra senders idle for
+  ``DC_POOL_IDLE_SECONDS`` (default 300) are closed
+
+First-byte latency per DC and connection churn (senders opened, closed
+idle, failed checks) are printed when the client disconnects and saved to
+``DC_POOL_STATE_FILE``. ``DC_POOL=0`` leaves Telethon's own handling in
+place.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from telethon.tl import functions
+
+from blocking_io import JsonSaver
+from instrumentation import Histogram, timer
+
+ENABLED = os.getenv('DC_POOL', '1') not in ('', '0')
+MAX_SENDERS = int(os.getenv('DC_POOL_MAX_SENDERS', '3'))
+BORROWS_PER_SENDER = int(os.getenv('DC_POOL_BORROWS_PER_SENDER', '2'))
+PREWARM_DAYS = float(os.getenv('DC_POOL_PREWARM_DAYS', '7'))
+HEALTH_INTERVAL = float(os.getenv('DC_POOL_HEALTH_INTERVAL', '30'))
+IDLE_SECONDS = float(os.getenv('DC_POOL_IDLE_SECONDS', '300'))
+STATE_FILE = os.getenv('DC_POOL_STATE_FILE', 'dc_pool.json')
+PING_TIMEOUT = 10
+
+
+def media_dc(media) -> Optional[int]:
+    """DC that stores the file of a message or media object"""
+    for attr in ('document', 'photo'):
+        inner = getattr(media, attr, None)
+        if inner is not None:
+            return getattr(inner, 'dc_id', None)
+    return getattr(media, 'dc_id', None)
+
+
+class PooledSender:
+    __slots__ = ('sender', 'borrows', 'last_used')
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.borrows = 0
+        self.last_used = time.monotonic()
+
+
+class DcSenderPool:
+    """Exported senders per DC, sized by demand and kept healthy.
+
+    ``install`` points the client's ``_borrow_exported_sender`` and
+    ``_return_exported_sender`` at the pool, so every Telethon download
+    from a foreign DC goes through it, and closes the pool when the client
+    disconnects.
+    """
+
+    def __init__(self, client, state_file=STATE_FILE):
+        self.client = client
+        self.state_file = state_file
+        self.senders: Dict[int, List[PooledSender]] = defaultdict(list)
+        self.locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Exporting auth goes through the client's shared init request; open one sender at a time
+        self.opening = asyncio.Lock()
+        self.seen: Dict[str, str] = self.load_seen()
+        self.warm = set()
+        self.churn = defaultdict(lambda: {'opened': 0, 'closed_idle': 0, 'failed_checks': 0})
+        self.first_byte = defaultdict(Histogram)
+        self.saver = JsonSaver(state_file, self.snapshot, stage='save_dc_pool', indent=2)
+        self.task: Optional[asyncio.Task] = None
+        self.installed = False
+        self.closed = False
+
+    def load_seen(self) -> Dict[str, str]:
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r') as f:
+                    return json.load(f).get('seen', {})
+        except (OSError, ValueError) as e:
+            print(f"Error loading DC pool state: {e}")
+        return {}
+
+    def snapshot(self) -> dict:
+        return {'seen': dict(self.seen), 'dcs': self.to_dict()}
+
+    def install(self):
+        """Route the client's exported-sender borrows through the pool"""
+        if self.installed or not ENABLED:
+            return
+        self._disconnect_client = self.client._disconnect_coro
+        self.client._borrow_exported_sender = self.borrow
+        self.client._return_exported_sender = self.give_back
+        self.client._disconnect_coro = self._disconnect
+        self.installed = True
+
+    def start(self):
+        """Pre-warm recently used DCs and start health checks; call once the client is connected"""
+        if not self.installed or (self.task and not self.task.done()):
+            return
+        self.closed = False
+        self.task = asyncio.get_running_loop().create_task(self._maintain())
+
+    def recent_dcs(self) -> List[int]:
+        cutoff = datetime.now() - timedelta(days=PREWARM_DAYS)
+        return sorted(int(dc_id) for dc_id, day in self.seen.items() if datetime.fromisoformat(day) >= cutoff)
+
+    def note_dc(self, dc_id):
+        self.warm.add(dc_id)
+        today = datetime.now().date().isoformat()
+        if self.seen.get(str(dc_id)) != today:
+            self.seen[str(dc_id)] = today
+            self.saver.save()
+
+    async def open(self, dc_id) -> PooledSender:
+        async with self.opening:
+            with timer('dc_connect', f"dc{dc_id}"):
+                sender = await self.client._create_exported_sender(dc_id)
+        sender.dc_id = dc_id
+        entry = PooledSender(sender)
+        self.senders[dc_id].append(entry)
+        self.churn[dc_id]['opened'] += 1
+        return entry
+
+    async def drop(self, dc_id, entry, reason):
+        self.senders[dc_id].remove(entry)
+        self.churn[dc_id][reason] += 1
+        await entry.sender.disconnect()
+
+    async def borrow(self, dc_id):
+        """The least busy sender for ``dc_id``, opening another while all are busy"""
+        async with self.locks[dc_id]:
+            entries = [entry for entry in self.senders[dc_id] if entry.sender.is_connected() or entry.borrows]
+            entry = min(entries, key=lambda item: item.borrows, default=None)
+            if entry is None or (entry.borrows >= BORROWS_PER_SENDER and len(entries) < MAX_SENDERS):
+                entry = await self.open(dc_id)
+            entry.borrows += 1
+            entry.last_used = time.monotonic()
+        self.note_dc(dc_id)
+        return entry.sender
+
+    async def give_back(self, sender):
+        for entry in self.senders.get(sender.dc_id, ()):
+            if entry.sender is sender:
+                entry.borrows -= 1
+                entry.last_used = time.monotonic()
+                return
+
+    async def prewarm(self):
+        """Connect to each recently used DC before a transfer has to wait for it"""
+        home = self.client.session.dc_id
+        for dc_id in self.recent_dcs():
+            if dc_id == home:
+                continue
+            try:
+                async with self.locks[dc_id]:
+                    if not self.senders[dc_id]:
+                        await self.open(dc_id)
+                self.warm.add(dc_id)
+            except Exception as e:
+                print(f"✗ Could not pre-warm a sender for DC {dc_id}: {type(e).__name__}: {e}")
+        if self.warm:
+            print(f"✓ Pre-warmed senders for DC {', '.join(map(str, sorted(self.warm)))}")
+
+    async def ping(self, dc_id, entry) -> bool:
+        try:
+            with timer('dc_ping', f"dc{dc_id}"):
+                request = functions.PingRequest(ping_id=random.randrange(-2**63, 2**63))
+                await asyncio.wait_for(entry.sender.send(request), PING_TIMEOUT)
+            return True
+        except Exception as e:
+            print(f"✗ DC {dc_id} sender failed its health check ({type(e).__name__}); replacing it")
+            return False
+
+    async def check(self):
+        """Ping idle senders, replace those that fail and close extras left idle"""
+        for dc_id, entries in list(self.senders.items()):
+            for entry in list(entries):
+                if entry.borrows:
+                    continue
+                # The first sender of a DC in use stays; extra ones go once idle
+                idle = time.monotonic() - entry.last_used > IDLE_SECONDS
+                if idle and not (dc_id in self.warm and entry is entries[0]):
+                    reason = 'closed_idle'
+                elif not await self.ping(dc_id, entry):
+                    reason = 'failed_checks'
+                else:
+                    continue
+                async with self.locks[dc_id]:
+                    if not entry.borrows and entry in entries:
+                        await self.drop(dc_id, entry, reason)
+            if dc_id in self.warm and not entries:
+                async with self.locks[dc_id]:
+                    if not entries:
+                        await self.open(dc_id)
+
+    async def _maintain(self):
+        await self.prewarm()
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Error checking DC senders: {type(e).__name__}: {e}")
+
+    def first_byte_progress(self, media, callback=None):
+        """Progress callback recording how long ``media``'s first chunk took to arrive"""
+        dc_id = media_dc(media)
+        started = time.monotonic()
+        waiting = True
+
+        def progress(current, total):
+            nonlocal waiting
+            if waiting:
+                waiting = False
+                self.first_byte[dc_id].record(time.monotonic() - started)
+            if callback:
+                callback(current, total)
+
+        return progress
+
+    def to_dict(self) -> dict:
+        return {
+            dc_id: {
+                'senders': len(self.senders.get(dc_id, ())),
+                **self.churn[dc_id],
+                'first_byte': self.first_byte[dc_id].to_dict()
+            }
+            for dc_id in sorted(set(self.churn) | set(self.first_byte), key=str)
+        }
+
+    def print_report(self):
+        rows = self.to_dict()
+        if not rows:
+            return
+        print("\nDC senders:")
+        for dc_id, row in rows.items():
+            first_byte = row['first_byte']
+            print(f"DC {dc_id}: {row['opened']} opened, {row['closed_idle']} closed idle, "
+                  f"{row['failed_checks']} failed checks; first byte p50 {first_byte['p50_ms']:.0f} ms, "
+                  f"p90 {first_byte['p90_ms']:.0f} ms over {first_byte['count']} files")
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.task:
+            self.task.cancel()
+        for entries in self.senders.values():
+            for entry in entries:
+                await entry.sender.disconnect()
+        self.senders.clear()
+        self.print_report()
+        if self.seen:
+            self.saver.save()
+            await self.saver.flush()
+
+    async def _disconnect(self):
+        await self.close()
+        await self._disconnect_client()
+
+
+_pools: Dict[int, DcSenderPool] = {}
+
+
+def get_pool(client) -> DcSenderPool:
+    """The pool of ``client``, installed on first use so pipelines sharing a client share it"""
+    pool = _pools.get(id(client))
+    if pool is None:
+        pool = _pools[id(client)] = DcSenderPool(client)
+        pool.install()
+    return pool
@@ -0,0 +1,248 @@
+import difflib
+import os
+import re
+import sqlite3
+from datetime import datetime
+from typing import List, Optional
+
+from telethon import utils
+from telethon.errors import FloodWaitError, RPCError
+from telethon.tl import functions
+from telethon.tl.types import Channel, Chat, InputPeerChannel, InputPeerChat, InputPeerUser, User
+
+INVENTORY_FILE = os.getenv('DIALOG_INVENTORY_PATH', 'dialogs.db')
+
+SCHEMA = """
+create table if not exists dialogs (
+    id integer primary key,
+    type text not null,
+    username text,
+    title text not null,
+    title_norm text not null,
+    members integer,
+    last_activity text,
+    access_hash integer,
+    updated_at text not null
+);
+create index if not exists dialogs_username on dialogs (username);
+create index if not exists dialogs_title_norm on dialogs (title_norm);
+create table if not exists dialog_words (
+    word text not null,
+    dialog_id integer not null,
+    primary key (word, dialog_id)
+) without rowid;
+create table if not exists meta (
+    key text primary key,
+    value text
+);
+"""
+
+
+def normalize(text) -> str:
+    return ' '.join(re.findall(r'\w+', str(text).lower()))
+
+
+def dialog_type(entity) -> str:
+    if isinstance(entity, Channel):
+        return 'megagroup' if entity.megagroup else 'channel'
+    if isinstance(entity, Chat):
+        return 'group'
+    if isinstance(entity, User):
+        return 'bot' if entity.bot else 'user'
+    return 'other'
+
+
+class DialogInventory:
+    """Local SQLite inventory of the account's dialogs.
+
+    ``refresh`` walks ``iter_dialogs`` newest-first and stops at the first
+    unpinned dialog that is older than the newest one seen last time, so
+    only dialogs with new activity are fetched. Lookups by id, username or
+    title use indexes; ``search`` ranks fuzzy title matches from a word
+    index. Stored access hashes let entities be fetched without a dialog scan.
+    Member counts of groups and channels that ``iter_dialogs`` leaves out
+    are fetched with one full-chat request each, only for dialogs updated
+    by the refresh.
+    """
+
+    def __init__(self, path=INVENTORY_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def get_meta(self, key) -> Optional[str]:
+        row = self.conn.execute('select value from meta where key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute('insert or replace into meta values (?, ?)', (key, value))
+
+    def upsert(self, dialog):
+        entity = dialog.entity
+        title = dialog.name or ''
+        self.conn.execute(
+            'insert or replace into dialogs values (?,?,?,?,?,?,?,?,?)',
+            (
+                dialog.id,
+                dialog_type(entity),
+                (getattr(entity, 'username', None) or '').lower() or None,
+                title,
+                normalize(title),
+                getattr(entity, 'participants_count', None),
+                dialog.date.isoformat() if dialog.date else None,
+                getattr(entity, 'access_hash', None),
+                datetime.now().isoformat()
+            )
+        )
+        self.conn.execute('delete from dialog_words where dialog_id = ?', (dialog.id,))
+        self.conn.executemany(
+            'insert or ignore into dialog_words values (?, ?)',
+            [(word, dialog.id) for word in set(normalize(title).split())]
+        )
+
+    async def refresh(self, client, full=False) -> int:
+        """Fetch dialogs with activity since the last refresh; ``full`` rebuilds the inventory"""
+        top_date = None if full else self.get_meta('top_date')
+        newest = None
+        seen = set()
+        count = 0
+        missing_members = []
+        async for dialog in client.iter_dialogs():
+            date = dialog.date.isoformat() if dialog.date else None
+            if top_date and not dialog.pinned and (date is None or date < top_date):
+                break
+            self.upsert(dialog)
+            if isinstance(dialog.entity, (Channel, Chat)) and getattr(dialog.entity, 'participants_count', None) is None:
+                missing_members.append(dialog)
+            seen.add(dialog.id)
+            count += 1
+            if date and (newest is None or date > newest) and not dialog.pinned:
+                newest = date
+        await self.fetch_members(client, missing_members)
+        if full:
+            # Drop dialogs the account has left since the last full refresh
+            stale = [row['id'] for row in self.conn.execute('select id from dialogs') if row['id'] not in seen]
+            self.conn.executemany('delete from dialogs where id = ?', [(dialog_id,) for dialog_id in stale])
+            self.conn.executemany('delete from dialog_words where dialog_id = ?', [(dialog_id,) for dialog_id in stale])
+        if newest and (top_date is None or newest > top_date):
+            self.set_meta('top_date', newest)
+        self.set_meta('refreshed_at', datetime.now().isoformat())
+        self.conn.commit()
+        return count
+
+    async def fetch_members(self, client, dialogs):
+        """Store member counts from GetFullChannel/GetFullChat for ``dialogs``"""
+        for done, dialog in enumerate(dialogs):
+            entity = dialog.entity
+            try:
+                if isinstance(entity, Channel):
+                    full = await client(functions.channels.GetFullChannelRequest(entity))
+                    members = full.full_chat.participants_count
+                else:
+                    full = await client(functions.messages.GetFullChatRequest(entity.id))
+                    members = len(getattr(full.full_chat.participants, 'participants', None) or []) or None
+            except FloodWaitError as e:
+                # Counts are nice to have; the remaining ones are fetched by the next refresh that sees them
+                print(f"Flood wait of {e.seconds}s fetching member counts; skipped {len(dialogs) - done} dialogs")
+                return
+            except (ValueError, RPCError):
+                continue
+            self.conn.execute('update dialogs set members = ? where id = ?', (members, dialog.id))
+
+    def is_empty(self) -> bool:
+        return self.conn.execute('select 1 from dialogs limit 1').fetchone() is None
+
+    def rows(self, types=None) -> List[dict]:
+        query = 'select * from dialogs'
+        if types:
+            query += f" where type in ({','.join('?' * len(types))})"
+        return [dict(row) for row in self.conn.execute(query + ' order by last_activity desc', tuple(types or ()))]
+
+    def find(self, name) -> Optional[dict]:
+        """Exact match on any id format, username or title"""
+        name = str(name).strip()
+        if name.replace('-', '').isdigit():
+            clean_id = name.replace('-100', '').lstrip('-')
+            for dialog_id in (int(name), int(f"-100{clean_id}"), int(clean_id), -int(clean_id)):
+                row = self.conn.execute('select * from dialogs where id = ?', (dialog_id,)).fetchone()
+                if row:
+                    return dict(row)
+            return None
+        row = self.conn.execute('select * from dialogs where username = ?', (name.lstrip('@').lower(),)).fetchone()
+        if not row:
+            row = self.conn.execute('select * from dialogs where title_norm = ?', (normalize(name),)).fetchone()
+        return dict(row) if row else None
+
+    def search(self, query, limit=5) -> List[dict]:
+        """Dialogs whose title or username best matches ``query``, best first"""
+        query_norm = normalize(query)
+        words = query_norm.split()
+        scores = {}
+        for word in words:
+            # Prefix range scan on the word index
+            for row in self.conn.execute(
+                'select dialog_id from dialog_words where word >= ? and word < ?', (word, word + '\uffff')
+            ):
+                scores[row['dialog_id']] = scores.get(row['dialog_id'], 0) + 1
+        if len(scores) >= limit:
+            candidates = [
+                dict(row) for row in self.conn.execute(
+                    f"select * from dialogs where id in ({','.join('?' * len(scores))})", tuple(scores)
+                )
+            ]
+        else:
+            # Too few word hits, maybe a typo: rank every title
+            candidates = self.rows()
+
+        def score(row):
+            similarity = max(
+                difflib.SequenceMatcher(None, query_norm, row['title_norm']).ratio(),
+                difflib.SequenceMatcher(None, query_norm, row['username'] or '').ratio()
+            )
+            return similarity + 0.5 * scores.get(row['id'], 0) / max(len(words), 1)
+
+        ranked = sorted(candidates, key=score, reverse=True)
+        return [row for row in ranked[:limit] if score(row) > 0.4]
+
+    @staticmethod
+    def input_peer(row):
+        """Input peer for a row, so the entity can be fetched without a dialog scan"""
+        real_id, _ = utils.resolve_id(row['id'])
+        if row['type'] in ('channel', 'megagroup'):
+            return InputPeerChannel(real_id, row['access_hash'])
+        if row['type'] == 'group':
+            return InputPeerChat(real_id)
+        return InputPeerUser(real_id, row['access_hash'])
+
+    async def get_entity(self, client, name):
+        """Entity for ``name`` from the inventory, or None if it is not known"""
+        row = self.find(name)
+        if not row:
+            return None
+        try:
+            return await client.get_entity(self.input_peer(row))
+        except (ValueError, RPCError):
+            # Left the chat or the access hash is stale; resolve it the slow way
+            return None
+
+    def suggest(self, name) -> str:
+        matches = self.search(name, limit=3)
+        if not matches:
+            return ''
+        return ' (did you mean ' + ', '.join(f"{row['title']} [{row['id']}]" for row in matches) + '?)'
+
+    @staticmethod
+    def format_row(row) -> str:
+        """One tab-separated line: type, id, username, title, members, last activity"""
+        return '\t'.join([
+            row['type'],
+            str(row['id']),
+            f"@{row['username']}" if row['username'] else '-',
+            row['title'],
+            str(row['members']) if row['members'] is not None else '-',
+            row['last_activity'] or '-'
+        ])
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,47 @@
+from typing import Dict
+
+
+class EntityCache:
+    """Resolve channel names or ids to entities once and share the result.
+
+    Accepts the same formats as ``TelegramUploader._get_entity_from_name``:
+    numeric ids with or without the ``-100`` prefix, usernames with or
+    without ``@``. With a ``DialogInventory``, known dialogs are fetched by
+    their stored access hash first.
+    """
+
+    def __init__(self, client, inventory=None):
+        self.client = client
+        self.inventory = inventory
+        self.entities: Dict[str, object] = {}
+
+    async def get(self, name):
+        key = str(name).strip().lstrip('@').lower()
+        if key not in self.entities:
+            self.entities[key] = await self.resolve(str(name).strip())
+        return self.entities[key]
+
+    async def resolve(self, name: str):
+        if self.inventory:
+            entity = await self.inventory.get_entity(self.client, name)
+            if entity:
+                return entity
+        try:
+            if name.replace('-', '').isdigit():
+                clean_id = name.replace('-100', '')
+                for id_format in [int(name), int(f"-100{clean_id}"), int(clean_id)]:
+                    try:
+                        return await self.client.get_entity(id_format)
+                    except ValueError:
+                        continue
+
+            name = name.lstrip('@')
+            for name_format in [name, f"@{name}", name.lower(), f"@{name.lower()}"]:
+                try:
+                    return await self.client.get_entity(name_format)
+                except ValueError:
+                    continue
+
+            raise ValueError(f"Could not find channel: {name}")
+        except Exception as e:
+            raise ValueError(f"Invalid channel format: {name} ({str(e)})")
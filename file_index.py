@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from blocking_io import JsonSaver
+from instrumentation import timed
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@timed('hash')
+def hash_file(filepath, chunk_size=HASH_CHUNK_SIZE) -> str:
+    """MD5 of a file, read in fixed-size chunks so memory use stays flat"""
+    digest = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """Persistent cache of content hashes keyed by (inode, size, mtime).
+
+    A file whose inode, size and mtime are unchanged is never read again;
+    a touched, copied or restored file gets a new key and is rehashed, but
+    keeps its content hash.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = Path(cache_file)
+        self.hashes: Dict[str, str] = self.load_cache()
+        self.dirty = False
+
+    def load_cache(self) -> dict:
+        try:
+            if self.cache_file.exists():
+                return json.loads(self.cache_file.read_text())
+            return {}
+        except Exception as e:
+            print(f"Error loading hash cache: {e}")
+            return {}
+
+    def save_cache(self):
+        if not self.dirty:
+            return
+        tmp_file = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        tmp_file.write_text(json.dumps(self.hashes))
+        os.replace(tmp_file, self.cache_file)
+        self.dirty = False
+
+    @staticmethod
+    def key(stat) -> str:
+        return f"{stat.st_ino}_{stat.st_size}_{stat.st_mtime_ns}"
+
+    def get(self, stat) -> Optional[str]:
+        return self.hashes.get(self.key(stat))
+
+    def set(self, stat, file_hash):
+        self.hashes[self.key(stat)] = file_hash
+        self.dirty = True
+
+
+class HashingWriter:
+    """File-like wrapper that hashes bytes as they are written"""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.md5()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.f.write(data)
+
+    def tell(self):
+        return self.f.tell()
+
+    def flush(self):
+        self.f.flush()
+
+    def hexdigest(self) -> str:
+        return self.digest.hexdigest()
+
+
+class FileIndex:
+    """Persistent index of downloaded documents.
+
+    Each entry describes one file on disk and lists every Telegram document
+    id and message id known to carry it. Lookups go by document id, by
+    (size, sanitized name) and by content hash, so the same file reposted
+    under a new message id can be skipped before any transfer starts.
+    """
+
+    def __init__(self, index_file):
+        self.index_file = Path(index_file)
+        self.entries: Dict[str, dict] = self.load_index()
+        self.saver = JsonSaver(
+            self.index_file, lambda: {name: dict(entry) for name, entry in self.entries.items()}, stage='save_index'
+        )
+        self._by_document: Dict[int, str] = {}
+        self._by_name_size: Dict[tuple, str] = {}
+        self._by_hash: Dict[str, str] = {}
+        for filename, entry in self.entries.items():
+            self._add_lookups(filename, entry)
+
+    def load_index(self) -> dict:
+        """Load the index from file"""
+        try:
+            if self.index_file.exists():
+                return json.loads(self.index_file.read_text())
+            return {}
+        except Exception as e:
+            print(f"Error loading file index: {e}")
+            return {}
+
+    def save_index(self):
+        """Atomically write the index to file, off the event loop when one is running"""
+        self.saver.save()
+
+    def _add_lookups(self, filename, entry):
+        for document_id in entry['document_ids']:
+            self._by_document[document_id] = filename
+        if entry.get('name') and entry.get('size') is not None:
+            self._by_name_size[(entry['size'], entry['name'])] = filename
+        if entry.get('hash'):
+            self._by_hash[entry['hash']] = filename
+
+    def find(self, document_id=None, size=None, name=None) -> Optional[dict]:
+        """Find an entry by document id, falling back to size and name"""
+        filename = self._by_document.get(document_id)
+        if filename is None:
+            filename = self._by_name_size.get((size, name))
+        return self.entries.get(filename) if filename else None
+
+    def find_by_hash(self, file_hash) -> Optional[dict]:
+        filename = self._by_hash.get(file_hash)
+        return self.entries.get(filename) if filename else None
+
+    def get(self, filename) -> Optional[dict]:
+        return self.entries.get(filename)
+
+    def cached_hash(self, filename, size) -> Optional[str]:
+        """Hash recorded for ``filename`` if the file still has the indexed size"""
+        entry = self.entries.get(filename)
+        if entry and entry['size'] == size:
+            return entry['hash']
+        return None
+
+    def add(self, filename, size, name, file_hash=None, document_id=None, message_id=None, save=True) -> dict:
+        """Record a file on disk and persist the index unless ``save`` is False"""
+        entry = {
+            'filename': filename,
+            'size': size,
+            'name': name,
+            'hash': file_hash,
+            'document_ids': [document_id] if document_id is not None else [],
+            'message_ids': [message_id] if message_id is not None else [],
+            'timestamp': datetime.now().isoformat()
+        }
+        self.entries[filename] = entry
+        self._add_lookups(filename, entry)
+        if save:
+            self.save_index()
+        return entry
+
+    def add_alias(self, entry, message_id=None, document_id=None):
+        """Record another message or document carrying an indexed file"""
+        changed = False
+        if message_id is not None and message_id not in entry['message_ids']:
+            entry['message_ids'].append(message_id)
+            changed = True
+        if document_id is not None and document_id not in entry['document_ids']:
+            entry['document_ids'].append(document_id)
+            self._by_document[document_id] = entry['filename']
+            changed = True
+        if changed:
+            self.save_index()
@@ -0,0 +1,156 @@
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class FolderWatcher:
+    """Report new or changed files in a folder as they appear.
+
+    A snapshot of ``{name: [size, mtime_ns]}`` for every file already
+    handled is persisted, so a restart only picks up what changed while the
+    process was down. On Linux, inotify reports files as soon as they are
+    closed after writing or moved in; elsewhere (or if inotify is not
+    available) the folder is diffed with ``os.scandir`` every
+    ``poll_interval`` seconds, and a file is only reported once its size and
+    mtime are the same on two consecutive scans.
+    """
+
+    def __init__(self, folder, snapshot_file, poll_interval=5.0):
+        self.folder = Path(folder)
+        self.snapshot_file = Path(snapshot_file)
+        self.poll_interval = poll_interval
+        self.snapshot: Dict[str, list] = self.load_snapshot()
+        self.pending: Dict[str, list] = {}
+        self.changes: asyncio.Queue = asyncio.Queue()
+        self.queued: Dict[str, list] = {}
+        self._inotify_fd: Optional[int] = None
+
+    def load_snapshot(self) -> dict:
+        """Load the folder snapshot from file"""
+        try:
+            if self.snapshot_file.exists():
+                return json.loads(self.snapshot_file.read_text())
+            return {}
+        except Exception as e:
+            print(f"Error loading folder snapshot: {e}")
+            return {}
+
+    def save_snapshot(self):
+        """Atomically write the folder snapshot to file"""
+        tmp_file = self.snapshot_file.with_name(self.snapshot_file.name + '.tmp')
+        tmp_file.write_text(json.dumps(self.snapshot))
+        os.replace(tmp_file, self.snapshot_file)
+
+    def mark_processed(self, filepath: Path, stat=None):
+        """Record ``filepath`` as handled so it is not reported again until it changes"""
+        stat = stat or filepath.stat()
+        self.snapshot[filepath.name] = [stat.st_size, stat.st_mtime_ns]
+        self.queued.pop(filepath.name, None)
+        self.save_snapshot()
+
+    def _report(self, name, signature):
+        if signature in (self.queued.get(name), self.snapshot.get(name)):
+            return
+        self.queued[name] = signature
+        self.changes.put_nowait(self.folder / name)
+
+    def scan(self, settle=True):
+        """Diff the folder against the snapshot and queue files that changed"""
+        seen = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                stat = entry.stat()
+                seen[entry.name] = [stat.st_size, stat.st_mtime_ns]
+
+        for name, signature in seen.items():
+            if self.snapshot.get(name) == signature:
+                continue
+            # Still being written if it changed since the last scan
+            if not settle or self.pending.get(name) == signature:
+                self._report(name, signature)
+            self.pending[name] = signature
+        for name in list(self.pending):
+            if name not in seen:
+                del self.pending[name]
+
+    def _start_inotify(self) -> bool:
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return False
+            wd = libc.inotify_add_watch(fd, str(self.folder).encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                return False
+        except (OSError, AttributeError):
+            return False
+
+        self._inotify_fd = fd
+        asyncio.get_running_loop().add_reader(fd, self._read_inotify)
+        return True
+
+    def _read_inotify(self):
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.scan(settle=False)
+            elif name and not name.startswith('.'):
+                try:
+                    stat = (self.folder / name).stat()
+                except FileNotFoundError:
+                    continue
+                self._report(name, [stat.st_size, stat.st_mtime_ns])
+
+    def close(self):
+        if self._inotify_fd is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify_fd)
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+
+    async def watch(self) -> AsyncIterator[Path]:
+        """Yield files that are new or changed since the snapshot, forever"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        using_inotify = self._start_inotify()
+        print(f"Watching {self.folder} ({'inotify' if using_inotify else 'polling'})")
+        self.scan(settle=False)
+
+        poller = None
+        if not using_inotify:
+            poller = asyncio.create_task(self._poll())
+        try:
+            while True:
+                yield await self.changes.get()
+        finally:
+            if poller:
+                poller.cancel()
+            self.close()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.scan()
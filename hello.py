@@ -1,12 +1,23 @@
 from telethon import TelegramClient
 import os
+import shutil
 from dotenv import load_dotenv
 import asyncio
-import hashlib
 from datetime import datetime
 from humanize import naturalsize
 from typing import Dict, Set, List
 from telethon.tl.types import InputMediaPhoto, InputMediaDocument
+from bandwidth import get_shaper
+from batched_session import BatchedSQLiteSession
+from blocking_io import ainput, run_blocking, start_lag_monitor
+from dc_pool import get_pool
+from file_index import FileIndex, HashingWriter, hash_file
+from instrumentation import timed_iter, timer
+from spool import get_spool
+from history_reader import iter_history
+from takeout import BACKFILL_TAKEOUT
+from transfer_plan import TransferPlan, requests_per_second
+from upload_engine import UploadEngine
 
 # Load environment variables
 load_dotenv()
@@ -21,8 +32,12 @@ DELAY_BETWEEN_DOWNLOADS = 1
 MAX_DOWNLOADS_PER_MINUTE = 600
 MAX_DOWNLOADS_PER_HOUR = 30000
 
+# Album mode: Telegram allows up to 10 items of one kind per media group
+ALBUM_SIZE = 10
+
 # Directory settings
 DOWNLOADS_DIR = 'downloads'
+INDEX_FILE = 'media_index.json'
 
 class DownloadStats:
     def __init__(self):
@@ -55,17 +70,27 @@ class DownloadStats:
         return "Starting download..."
 
 class TelegramDownloader:
-    def __init__(self):
-        self.client = TelegramClient('image_session', api_id, api_hash)
+    def __init__(self, client=None, rate_limiter=None, entity_cache=None):
+        self.client = client or TelegramClient(BatchedSQLiteSession('image_session'), api_id, api_hash)
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
+        self.engine = UploadEngine(self.client)
+        self.spool = get_spool()
+        self.shaper = get_shaper()
+        self.dc_pool = get_pool(self.client)
+        # Read backfill history through a takeout session
+        self.takeout = BACKFILL_TAKEOUT
         self.stats = DownloadStats()
         self.existing_files: Dict[str, str] = {}
         self.processed_ids: Set[int] = set()
+        self.file_index = FileIndex(INDEX_FILE)
         self.target_channels = os.getenv('TELEGRAM_TARGET_CHANNELS', '').split(',')
         self.target_channels = [ch.strip() for ch in self.target_channels if ch.strip()]
 
     async def initialize(self):
         await self.client.start()
-        self.existing_files, _, _ = self.get_existing_files()
+        self.dc_pool.start()
+        self.existing_files, _, _ = await run_blocking(self.get_existing_files)
 
     def get_existing_files(self):
         existing_files = {}
@@ -75,24 +100,29 @@ class TelegramDownloader:
         for filename in os.listdir(DOWNLOADS_DIR):
             if filename.lower().endswith(('.jpg', '.jpeg', '.gif', '.png')):
                 filepath = os.path.join(DOWNLOADS_DIR, filename)
-                file_hash = self.get_file_hash(filepath)
+                file_size = os.path.getsize(filepath)
+                file_hash = self.file_index.cached_hash(filename, file_size)
+                if not file_hash:
+                    file_hash = self.get_file_hash(filepath)
+                    if file_hash:
+                        self.file_index.add(filename, file_size, filename, file_hash, save=False)
                 if file_hash:
                     existing_files[file_hash] = filename
-                    total_size += os.path.getsize(filepath)
+                    total_size += file_size
                     file_count += 1
                 try:
                     msg_id = int(filename.split('_')[1].split('.')[0])
                     self.processed_ids.add(msg_id)
                 except:
                     pass
+        self.file_index.save_index()
         return existing_files, total_size, file_count
 
     @staticmethod
     def get_file_hash(filepath):
         if not os.path.exists(filepath):
             return None
-        with open(filepath, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+        return hash_file(filepath)
 
     async def upload_to_channels(self, filepath: str) -> None:
         """Upload a file to all configured target channels."""
@@ -106,13 +136,13 @@ class TelegramDownloader:
             for channel in self.target_channels:
                 try:
                     if is_gif:
-                        await self.client.send_file(
+                        await self.engine.send_file(
                             channel,
                             filepath,
                             force_document=True
                         )
                     else:
-                        await self.client.send_file(
+                        await self.engine.send_file(
                             channel,
                             filepath,
                             force_document=False
@@ -125,9 +155,75 @@ class TelegramDownloader:
         except Exception as e:
             print(f"Error uploading {filepath}: {str(e)}")
 
-    async def download_media(self, start_from_msg_id=None):
-        channel = await self.client.get_entity(channel_username)
-        print(f"Connected to channel: {channel_username}")
+    async def upload_album_to_channels(self, filepaths: List[str]) -> None:
+        """Upload files to all target channels as albums of up to 10 photos or 10 GIFs."""
+        if not self.target_channels:
+            return
+
+        photos = [path for path in filepaths if not path.lower().endswith('.gif')]
+        gifs = [path for path in filepaths if path.lower().endswith('.gif')]
+        albums = [
+            (group[i:i + ALBUM_SIZE], group is gifs)
+            for group in (photos, gifs)
+            for i in range(0, len(group), ALBUM_SIZE)
+        ]
+
+        for album, is_gif in albums:
+            for channel in self.target_channels:
+                try:
+                    await self.engine.send_file(channel, album, force_document=is_gif)
+                    print(f"Uploaded album of {len(album)} files to {channel}")
+                    await asyncio.sleep(2)  # Rate limiting between uploads
+                except Exception as e:
+                    print(f"Failed to upload album to {channel}: {str(e)}")
+
+    async def get_channel(self, name):
+        if self.entity_cache:
+            return await self.entity_cache.get(name)
+        return await self.client.get_entity(name)
+
+    def wants_record(self, record) -> bool:
+        """Whether a mirrored message is a photo or GIF not downloaded yet"""
+        if record['id'] in self.processed_ids:
+            return False
+        return record['media'] == 'photo' or record['mime_type'] == 'image/gif'
+
+    async def plan_download(self, channel, start_from_msg_id=None, mirror=None) -> TransferPlan:
+        """Dry run: the photos and GIFs download_media would fetch, without fetching them"""
+        plan = TransferPlan(
+            'images', channel.id, getattr(channel, 'title', None),
+            targets=len(self.target_channels),
+            rate_limit=requests_per_second(self.rate_limiter),
+            delay_per_item=DELAY_BETWEEN_DOWNLOADS
+        )
+        await plan.scan(
+            self.client, channel, self.wants_record, mirror, offset_id=start_from_msg_id, takeout=self.takeout
+        )
+        plan.save()
+        plan.print_report()
+        return plan
+
+    async def run_saved_plan(self, channel_name=None):
+        """Download what the last dry run for the channel planned"""
+        channel = await self.get_channel(channel_name or channel_username)
+        plan = TransferPlan.load('images', channel.id)
+        if not plan:
+            print("No saved plan for this channel. Run a dry run first.")
+            return
+        await self.download_media(channel_name=channel_name, plan=plan)
+
+    async def download_media(self, start_from_msg_id=None, channel_name=None, mirror=None, dry_run=False, plan=None):
+        """Download photos and GIFs.
+
+        Plans from ``mirror`` (a HistoryMirror) if given. With ``dry_run``
+        only builds and saves a TransferPlan; with ``plan`` fetches exactly
+        the planned messages.
+        """
+        channel_name = channel_name or channel_username
+        channel = await self.get_channel(channel_name)
+        print(f"Connected to channel: {channel_name}")
+        if dry_run:
+            return await self.plan_download(channel, start_from_msg_id, mirror)
         print("Starting download...")
         
         download_count = 0
@@ -135,7 +231,20 @@ class TelegramDownloader:
         minute_start = datetime.now()
         last_progress_update = datetime.now()
 
-        async for message in self.client.iter_messages(channel, offset_id=start_from_msg_id):
+        if plan:
+            print(f"Running saved plan: {len(plan.items)} downloads")
+            messages = iter_history(self.client, channel, self.takeout, ids=plan.ids)
+        elif mirror:
+            max_id = start_from_msg_id - 1 if start_from_msg_id else None
+            message_ids = mirror.channel(channel.id).pending_ids(self.wants_record, max_id=max_id)[::-1]
+            print(f"Planned {len(message_ids)} downloads from the local mirror")
+            messages = iter_history(self.client, channel, self.takeout, ids=message_ids)
+        else:
+            messages = iter_history(self.client, channel, self.takeout, offset_id=start_from_msg_id)
+        async for message in timed_iter(messages, 'history_page', str(channel.id)):
+            # Messages deleted since they were mirrored come back as None
+            if message is None:
+                continue
             if message.id in self.processed_ids:
                 self.stats.skipped_files += 1
                 continue
@@ -155,6 +264,8 @@ class TelegramDownloader:
                             await asyncio.sleep(60 - (current_time - minute_start).total_seconds())
                         minute_count = 0
                         minute_start = datetime.now()
+                    if self.rate_limiter:
+                        await self.rate_limiter.wait()
 
                     # Determine file type and name
                     if message.photo:
@@ -165,13 +276,26 @@ class TelegramDownloader:
                         prefix = 'gif'
 
                     filename = f"{prefix}_{message.id}{ext}"
-                    path = await self.client.download_media(
-                        message.media,
-                        file=os.path.join(DOWNLOADS_DIR, filename)
-                    )
+                    path = os.path.join(DOWNLOADS_DIR, filename)
+                    # Stage in the spool and move into place once complete, hashing
+                    # the bytes as they arrive so the file is never read back
+                    async with self.spool.stage(message.file.size) as staging:
+                        staged_path = staging / filename
+                        with open(staged_path, 'wb') as f:
+                            writer = HashingWriter(f)
+                            with timer('download_media', str(channel.id)):
+                                await self.client.download_media(
+                                    message.media, file=writer,
+                                    progress_callback=self.shaper.download_progress(
+                                        self.dc_pool.first_byte_progress(message.media)
+                                    )
+                                )
+                            file_size = writer.tell()
+                        await run_blocking(shutil.move, staged_path, path)
+                    self.file_index.add(filename, file_size, filename, writer.hexdigest(), message_id=message.id)
+                    self.existing_files[writer.hexdigest()] = filename
 
                     # Update stats
-                    file_size = os.path.getsize(path)
                     self.stats.total_size += file_size
                     self.stats.downloaded_files += 1
                     self.processed_ids.add(message.id)
@@ -198,6 +322,7 @@ class TelegramDownloader:
 
 async def main_menu():
     downloader = TelegramDownloader()
+    start_lag_monitor()
     await downloader.initialize()
 
     while True:
@@ -206,9 +331,11 @@ async def main_menu():
         print("2. Resume from last message")
         print("3. Start from specific message ID")
         print("4. Upload existing files to channels")
-        print("5. Exit")
+        print("5. Plan download (dry run)")
+        print("6. Run saved plan")
+        print("7. Exit")
         
-        choice = input("\nEnter your choice (1-5): ")
+        choice = await ainput("\nEnter your choice (1-7): ")
         
         if choice == '1':
             await downloader.download_media()
@@ -224,7 +351,7 @@ async def main_menu():
         
         elif choice == '3':
             try:
-                msg_id = int(input("Enter message ID to start from: "))
+                msg_id = int(await ainput("Enter message ID to start from: "))
                 await downloader.download_media(start_from_msg_id=msg_id)
             except ValueError:
                 print("Invalid message ID. Please enter a number.")
@@ -235,13 +362,22 @@ async def main_menu():
                 print("No target channels configured. Please add TELEGRAM_TARGET_CHANNELS to .env")
                 continue
                 
-            for filename in os.listdir(DOWNLOADS_DIR):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.gif', '.png')):
-                    filepath = os.path.join(DOWNLOADS_DIR, filename)
-                    await downloader.upload_to_channels(filepath)
+            filepaths = [
+                os.path.join(DOWNLOADS_DIR, filename)
+                for filename in sorted(os.listdir(DOWNLOADS_DIR))
+                if filename.lower().endswith(('.jpg', '.jpeg', '.gif', '.png'))
+            ]
+            await downloader.upload_album_to_channels(filepaths)
         
         elif choice == '5':
+            await downloader.download_media(dry_run=True)
+        
+        elif choice == '6':
+            await downloader.run_saved_plan()
+        
+        elif choice == '7':
             print("Exiting...")
+            await downloader.file_index.saver.flush()
             break
         
         else:
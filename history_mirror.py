@@ -0,0 +1,198 @@
+"""Local mirror of channel message metadata.
+
+Each channel gets a folder under ``HISTORY_MIRROR_DIR`` holding gzip
+compressed JSONL segments, one record per message, and an ``index.json``
+with the sync watermark (highest mirrored id) and the id and date range of
+every segment. Syncing only fetches messages newer than the watermark, and
+several channels are synced at once. The forwarder and downloaders can
+then plan from the mirror and fetch just the messages they still need.
+
+Usage:
+    python history_mirror.py chan_a chan_b [--channels-file ebook_channels.txt]
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from telethon import TelegramClient
+
+from batched_session import BatchedSQLiteSession
+from blocking_io import run_blocking, start_lag_monitor
+from history_reader import HistoryReader
+from instrumentation import timed_iter
+from message_meta import message_record
+from pdfscrapper import load_channel_list
+
+# Load environment variables
+load_dotenv()
+
+MIRROR_DIR = os.getenv('HISTORY_MIRROR_DIR', 'history_mirror')
+MIRROR_CONCURRENCY = int(os.getenv('MIRROR_CONCURRENCY', '4'))
+SEGMENT_RECORDS = 50000
+
+
+class ChannelMirror:
+    """Mirrored metadata of one channel, readable without a client"""
+
+    def __init__(self, channel_id, root=MIRROR_DIR):
+        self.folder = Path(root) / str(channel_id)
+        self.index_file = self.folder / 'index.json'
+        self.index = self.load_index()
+
+    def load_index(self) -> dict:
+        try:
+            if self.index_file.exists():
+                return json.loads(self.index_file.read_text())
+        except Exception as e:
+            print(f"Error loading mirror index {self.index_file}: {e}")
+        return {'watermark': 0, 'count': 0, 'segments': []}
+
+    def save_index(self):
+        """Atomically write the index to file"""
+        tmp_file = self.index_file.with_name(self.index_file.name + '.tmp')
+        tmp_file.write_text(json.dumps(self.index, indent=2))
+        os.replace(tmp_file, self.index_file)
+
+    @property
+    def watermark(self) -> int:
+        return self.index['watermark']
+
+    def append(self, records: List[dict]):
+        """Append records with ids above the watermark, then advance it"""
+        records = [record for record in records if record['id'] > self.watermark]
+        if not records:
+            return
+        self.folder.mkdir(parents=True, exist_ok=True)
+        segments = self.index['segments']
+        if not segments or segments[-1]['count'] >= SEGMENT_RECORDS:
+            segments.append({
+                'file': f"{len(segments) + 1:06d}.jsonl.gz",
+                'first_id': records[0]['id'],
+                'first_date': records[0]['date'],
+                'count': 0,
+                'bytes': 0
+            })
+        segment = segments[-1]
+        path = self.folder / segment['file']
+        with open(path, 'ab') as f:
+            # Drop whatever a crash left after the last indexed write
+            f.truncate(segment['bytes'])
+            f.write(gzip.compress(''.join(json.dumps(record) + '\n' for record in records).encode()))
+            segment['bytes'] = f.tell()
+        segment['last_id'] = records[-1]['id']
+        segment['last_date'] = records[-1]['date']
+        segment['count'] += len(records)
+        self.index['count'] += len(records)
+        self.index['watermark'] = records[-1]['id']
+        self.index['synced_at'] = datetime.now().isoformat()
+        self.save_index()
+
+    def records(self, min_id=0, max_id=None, since: Optional[datetime] = None) -> Iterator[dict]:
+        """Mirrored records in id order, optionally limited by id range or date"""
+        since = since.isoformat() if since else None
+        for segment in self.index['segments']:
+            if segment['last_id'] < min_id or (since and segment['last_date'] < since):
+                continue
+            if max_id is not None and segment['first_id'] > max_id:
+                break
+            with open(self.folder / segment['file'], 'rb') as f:
+                data = f.read(segment['bytes'])
+            for line in gzip.decompress(data).decode().splitlines():
+                record = json.loads(line)
+                if record['id'] < min_id or (since and record['date'] < since):
+                    continue
+                if max_id is not None and record['id'] > max_id:
+                    return
+                yield record
+
+    def pending_ids(self, wanted: Callable[[dict], bool], **filters) -> List[int]:
+        """Ids of mirrored messages for which ``wanted(record)`` is true"""
+        return [record['id'] for record in self.records(**filters) if wanted(record)]
+
+
+class HistoryMirror:
+    """Sync the mirrors of several channels from the server"""
+
+    def __init__(self, client, root=MIRROR_DIR, rate_limiter=None, entity_cache=None):
+        self.client = client
+        self.root = root
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
+        self.mirrors: Dict[int, ChannelMirror] = {}
+
+    def channel(self, channel_id) -> ChannelMirror:
+        if channel_id not in self.mirrors:
+            self.mirrors[channel_id] = ChannelMirror(channel_id, self.root)
+        return self.mirrors[channel_id]
+
+    async def get_entity(self, name):
+        if self.entity_cache:
+            return await self.entity_cache.get(name)
+        return await self.client.get_entity(name)
+
+    async def sync_channel(self, name) -> int:
+        """Mirror every message newer than the channel's watermark"""
+        entity = await self.get_entity(name)
+        mirror = self.channel(entity.id)
+        mirror.index['name'] = str(name)
+        added = 0
+        pages = HistoryReader(
+            self.client, entity, min_id=mirror.watermark, reverse=True, rate_limiter=self.rate_limiter
+        ).pages()
+        async for messages in timed_iter(pages, 'history_page', str(entity.id)):
+            await run_blocking(mirror.append, [message_record(message) for message in messages])
+            added += len(messages)
+        print(f"✓ {name}: {added} new messages mirrored ({mirror.index['count']} total)")
+        return added
+
+    async def sync(self, channels) -> int:
+        slots = asyncio.Semaphore(MIRROR_CONCURRENCY)
+
+        async def sync_one(name):
+            async with slots:
+                try:
+                    return await self.sync_channel(name)
+                except Exception as e:
+                    print(f"✗ Error mirroring {name}: {type(e).__name__}: {str(e)}")
+                    return 0
+
+        return sum(await asyncio.gather(*(sync_one(name) for name in channels)))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Mirror channel message metadata to local JSONL segments')
+    parser.add_argument('channels', nargs='*', help='Channel usernames or ids')
+    parser.add_argument('--channels-file', help='File with one channel per line')
+    args = parser.parse_args()
+
+    channels = list(args.channels)
+    if args.channels_file:
+        channels += load_channel_list(args.channels_file)
+    if not channels:
+        parser.error('no channels given')
+
+    client = TelegramClient(
+        BatchedSQLiteSession('mirror_session'),
+        int(os.getenv('TELEGRAM_API_ID')),
+        os.getenv('TELEGRAM_API_HASH')
+    )
+    start_lag_monitor()
+    await client.start()
+    try:
+        total = await HistoryMirror(client).sync(channels)
+        print(f"\nMirrored {total} new messages from {len(channels)} channels")
+    finally:
+        await client.disconnect()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nMirror sync interrupted by user")
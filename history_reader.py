@@ -0,0 +1,176 @@
+"""Prefetching history reader with FloodWait-adaptive page pacing.
+
+``iter_messages`` only asks for the next page once the current one has been
+consumed, so every page fetch stalls the downloads and forwards behind
+it. ``HistoryReader`` fetches pages in a background task and keeps up to
+``HISTORY_PREFETCH_PAGES`` (default 2) ready while the current page is
+processed.
+
+Instead of Telethon's fixed ``wait_time`` between pages, all readers in a
+process share a ``PagePacer``: no delay until Telegram answers with a
+FloodWait, then a delay that doubles with every further FloodWait and
+shrinks again with every page that goes through.
+"""
+import asyncio
+import os
+import time
+from typing import List, Optional
+
+from telethon.errors import FloodWaitError
+from telethon.tl import functions
+
+from instrumentation import timer
+from takeout import backfill_reader
+
+PREFETCH_PAGES = int(os.getenv('HISTORY_PREFETCH_PAGES', '2'))
+PAGE_SIZE = 100
+MIN_PAGE_DELAY = 0.5
+MAX_PAGE_DELAY = 10.0
+PAGE_DELAY_DECAY = 0.9
+# Requests behind get_messages; takeout sessions record floods under their wrapper
+HISTORY_REQUESTS = (
+    functions.messages.GetHistoryRequest.CONSTRUCTOR_ID,
+    functions.messages.GetMessagesRequest.CONSTRUCTOR_ID,
+    functions.channels.GetMessagesRequest.CONSTRUCTOR_ID,
+    functions.InvokeWithTakeoutRequest.CONSTRUCTOR_ID,
+)
+
+
+class PagePacer:
+    """Delay between history page requests, adapted to FloodWaits"""
+
+    def __init__(self):
+        self.delay = 0.0
+        self.floods = 0
+
+    async def wait(self):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    def on_flood(self, seconds):
+        self.floods += 1
+        self.delay = min(MAX_PAGE_DELAY, max(MIN_PAGE_DELAY, self.delay * 2))
+        print(f"Flood wait of {seconds}s reading history; pacing pages {self.delay:.1f}s apart")
+
+    def on_page(self):
+        self.delay *= PAGE_DELAY_DECAY
+        if self.delay < MIN_PAGE_DELAY / 10:
+            self.delay = 0.0
+
+
+_pacer: Optional[PagePacer] = None
+
+
+def get_pacer() -> PagePacer:
+    """The process-wide pacer; history flood limits apply to the whole account"""
+    global _pacer
+    if _pacer is None:
+        _pacer = PagePacer()
+    return _pacer
+
+
+def _flood_due(client) -> float:
+    # Telethon records every FloodWait here by request type, including the short ones it sleeps through itself
+    waited = getattr(client, '_flood_waited_requests', {})
+    return max((waited[request] for request in HISTORY_REQUESTS if request in waited), default=0)
+
+
+async def fetch_history_page(client, entity, rate_limiter=None, pacer=None, **kwargs) -> List:
+    """One ``get_messages`` page, paced and retried after FloodWaits"""
+    pacer = pacer or get_pacer()
+    while True:
+        await pacer.wait()
+        if rate_limiter:
+            await rate_limiter.wait()
+        flood_due = _flood_due(client)
+        started = time.time()
+        try:
+            with timer('history_fetch', str(getattr(entity, 'id', entity))):
+                page = await client.get_messages(entity, **kwargs)
+        except FloodWaitError as e:
+            pacer.on_flood(e.seconds)
+            await asyncio.sleep(e.seconds)
+            continue
+        if _flood_due(client) > flood_due:
+            pacer.on_flood(round(_flood_due(client) - started))
+        else:
+            pacer.on_page()
+        return page
+
+
+class HistoryReader:
+    """Async iterator over a chat's messages, like ``iter_messages``, with pages prefetched.
+
+    Takes the ``iter_messages`` arguments it replaces: ``limit``,
+    ``offset_id``, ``min_id`` and ``reverse``, or ``ids`` to fetch given
+    messages (missing ones come back as None). ``pages()`` yields whole
+    pages instead of messages.
+    """
+
+    def __init__(self, client, entity, limit=None, offset_id=0, min_id=0, reverse=False, ids=None,
+                 prefetch=PREFETCH_PAGES, rate_limiter=None):
+        self.client = client
+        self.entity = entity
+        self.limit = limit
+        self.offset_id = offset_id or 0
+        self.min_id = min_id or 0
+        self.reverse = reverse
+        self.ids = list(ids) if ids is not None else None
+        self.prefetch = max(1, prefetch)
+        self.rate_limiter = rate_limiter
+
+    async def _fetch(self, **kwargs):
+        return await fetch_history_page(self.client, self.entity, self.rate_limiter, **kwargs)
+
+    async def _produce(self, queue: asyncio.Queue):
+        try:
+            if self.ids is not None:
+                for start in range(0, len(self.ids), PAGE_SIZE):
+                    await queue.put(await self._fetch(ids=self.ids[start:start + PAGE_SIZE]))
+            else:
+                left = self.limit
+                offset_id = self.offset_id
+                while left is None or left > 0:
+                    size = PAGE_SIZE if left is None else min(PAGE_SIZE, left)
+                    page = await self._fetch(limit=size, offset_id=offset_id, min_id=self.min_id, reverse=self.reverse)
+                    if page:
+                        await queue.put(page)
+                    if len(page) < size:
+                        break
+                    # Pages run newest-first, or oldest-first when reversed
+                    offset_id = page[-1].id
+                    if left is not None:
+                        left -= len(page)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    async def pages(self):
+        queue = asyncio.Queue(maxsize=self.prefetch)
+        producer = asyncio.create_task(self._produce(queue))
+        try:
+            while True:
+                page = await queue.get()
+                if page is None:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            producer.cancel()
+
+    async def _messages(self):
+        async for page in self.pages():
+            for message in page:
+                yield message
+
+    def __aiter__(self):
+        return self._messages()
+
+
+async def iter_history(client, entity, takeout=None, **kwargs):
+    """Prefetched history, read through a takeout session when ``takeout`` is on"""
+    async with backfill_reader(client, takeout) as reader:
+        async for message in HistoryReader(reader, entity, **kwargs):
+            yield message
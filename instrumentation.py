@@ -0,0 +1,258 @@
+"""Per-stage latency histograms and on-demand profiling.
+
+Turned on with environment variables, and free when they are unset:
+
+    INSTRUMENT=1            time the hot-path stages (history pages, downloads,
+                            sends, history saves, hashing, console output) and
+                            print a latency table per stage and target at exit
+    INSTRUMENT_REPORT_FILE  where the table is also saved as JSON
+                            (default stage_metrics.json)
+    PROFILE=cpu,memory      capture cProfile and/or tracemalloc for a window
+                            (implies INSTRUMENT=1)
+    PROFILE_START=60        seconds after the first timed stage to start (default 0)
+    PROFILE_SECONDS=30      length of each window (default 60)
+    PROFILE_EVERY=600       repeat a window this often (default: once)
+    PROFILE_DIR=profiles    where captures are written
+
+With ``INSTRUMENT`` unset, ``timer`` returns a shared no-op context manager
+and ``timed`` and ``timed_iter`` return what they were given unchanged.
+"""
+import asyncio
+import atexit
+import cProfile
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+PROFILE = {mode.strip() for mode in os.getenv('PROFILE', '').split(',') if mode.strip()}
+ENABLED = os.getenv('INSTRUMENT', '') not in ('', '0') or bool(PROFILE)
+REPORT_FILE = os.getenv('INSTRUMENT_REPORT_FILE', 'stage_metrics.json')
+PROFILE_START = float(os.getenv('PROFILE_START', '0'))
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '60'))
+PROFILE_EVERY = float(os.getenv('PROFILE_EVERY', '0'))
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', 'profiles'))
+# Bucket values keep this many significant bits: under 2% relative error
+SIGNIFICANT_BITS = 7
+
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    """Latency histogram with log-linear buckets, like HdrHistogram.
+
+    Values are recorded in microseconds and rounded down to
+    ``SIGNIFICANT_BITS`` significant bits, so memory stays small however
+    many values are recorded and percentiles keep a bounded relative error.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = int(seconds * 1_000_000)
+        shift = max(0, micros.bit_length() - SIGNIFICANT_BITS)
+        self.counts[(micros >> shift) << shift] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p) -> float:
+        """Latency in seconds below which ``p`` percent of values fall"""
+        if not self.count:
+            return 0.0
+        wanted = self.count * p / 100
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= wanted:
+                return bucket / 1_000_000
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total_s': round(self.total, 4),
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p90_ms': round(self.percentile(90) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+
+class ProfileWindow:
+    """cProfile and tracemalloc captures for ``PROFILE_SECONDS`` at a time.
+
+    Scheduled on the event loop, so cProfile sees the loop thread where the
+    pipelines run.
+    """
+
+    def __init__(self, modes):
+        self.modes = modes
+        self.profiler = None
+        self.scheduled = False
+
+    def schedule(self):
+        if self.scheduled or not self.modes:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.scheduled = True
+        loop.call_later(PROFILE_START, self.begin)
+
+    def begin(self):
+        print(f"Profiling ({', '.join(sorted(self.modes))}) for {PROFILE_SECONDS:.0f}s")
+        if 'memory' in self.modes:
+            tracemalloc.start()
+        if 'cpu' in self.modes:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        asyncio.get_running_loop().call_later(PROFILE_SECONDS, self.end)
+
+    def end(self):
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if self.profiler:
+            self.profiler.disable()
+            path = PROFILE_DIR / f"cpu_{stamp}.prof"
+            self.profiler.dump_stats(path)
+            self.profiler = None
+            print(f"✓ CPU profile saved to {path}")
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            path = PROFILE_DIR / f"memory_{stamp}.txt"
+            with open(path, 'w') as f:
+                for stat in snapshot.statistics('lineno')[:50]:
+                    f.write(f"{stat}\n")
+            print(f"✓ Memory profile saved to {path}")
+        if PROFILE_EVERY:
+            asyncio.get_running_loop().call_later(max(0, PROFILE_EVERY - PROFILE_SECONDS), self.begin)
+
+
+class Metrics:
+    """Histograms keyed by ``(stage, target)``, safe to record from threads"""
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.lock = threading.Lock()
+
+    def record(self, stage, target, seconds):
+        with self.lock:
+            self.histograms[(stage, target)].record(seconds)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                f"{stage}[{target}]" if target is not None else stage: histogram.to_dict()
+                for (stage, target), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0]))
+            }
+
+    def print_report(self):
+        rows = self.to_dict()
+        if not rows:
+            return
+        print("\nStage latency:")
+        print(f"{'stage':<40} {'count':>8} {'total s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, row in rows.items():
+            print(f"{name[:40]:<40} {row['count']:>8} {row['total_s']:>9.2f} {row['p50_ms']:>9.1f} "
+                  f"{row['p90_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+
+    def save_report(self, path=REPORT_FILE):
+        try:
+            with open(path, 'w') as f:
+                json.dump({'timestamp': datetime.now().isoformat(), 'stages': self.to_dict()}, f, indent=2)
+        except OSError as e:
+            print(f"Error saving stage metrics: {e}")
+
+
+metrics = Metrics()
+profile_window = ProfileWindow(PROFILE)
+
+
+class _Timer:
+    __slots__ = ('stage', 'target', 'started')
+
+    def __init__(self, stage, target):
+        self.stage = stage
+        self.target = target
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics.record(self.stage, self.target, time.perf_counter() - self.started)
+        return False
+
+
+def timer(stage, target=None):
+    """Context manager that records how long its block took under ``stage``"""
+    if not ENABLED:
+        return _NULL_TIMER
+    profile_window.schedule()
+    return _Timer(stage, target)
+
+
+def timed(stage):
+    """Decorator recording every call of a function or coroutine function"""
+    def decorate(func):
+        if not ENABLED:
+            return func
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_iter(iterator, stage, target=None):
+    """Record the wait for every item of an async iterator.
+
+    For ``iter_messages`` most items come from the current page, so the
+    slow tail of the histogram is the page fetches.
+    """
+    if not ENABLED:
+        return iterator
+    return _timed_iter(iterator, stage, target)
+
+
+async def _timed_iter(iterator, stage, target):
+    iterator = iterator.__aiter__()
+    while True:
+        with timer(stage, target):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+def _report_at_exit():
+    metrics.print_report()
+    if metrics.histograms:
+        metrics.save_report()
+
+
+if ENABLED:
+    atexit.register(_report_at_exit)
@@ -0,0 +1,31 @@
+from typing import Optional
+
+
+def media_type(message) -> Optional[str]:
+    if not getattr(message, 'media', None):
+        return None
+    for kind in ('photo', 'gif', 'sticker', 'video', 'voice', 'audio', 'document', 'web_preview', 'poll'):
+        if getattr(message, kind, None):
+            return kind
+    return 'other'
+
+
+def message_record(message) -> dict:
+    """Metadata of one message as kept in the history mirror and transfer plans.
+
+    Service messages have no media or caption.
+    """
+    document = getattr(message, 'document', None)
+    file = getattr(message, 'file', None)
+    return {
+        'id': message.id,
+        'date': message.date.isoformat() if message.date else None,
+        'grouped_id': getattr(message, 'grouped_id', None),
+        'media': media_type(message),
+        'document_id': document.id if document else None,
+        'size': file.size if file else None,
+        'file_name': file.name if file else None,
+        'mime_type': file.mime_type if file else None,
+        'caption': getattr(message, 'message', None) or None,
+        'views': getattr(message, 'views', None)
+    }
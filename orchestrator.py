@@ -0,0 +1,250 @@
+"""Run several download, upload and forward pipelines in one process.
+
+All jobs share one authorized TelegramClient and session file, one
+request rate limiter, one entity cache and one event loop, instead of
+each script opening its own MTProto connection and session.
+
+Usage:
+    python orchestrator.py --config orchestrator.json [--once]
+
+Config file (JSON):
+    {
+      "session": "orchestrator_session",
+      "rate_limit": {"requests": 30, "window": 1},
+      "max_concurrent_jobs": 4,
+      "jobs": [
+        {"name": "ebooks", "type": "ebooks", "channels": ["chan_a", "chan_b"]},
+        {"name": "images", "type": "images", "channel": "chan_c", "interval": 3600},
+        {"name": "upload", "type": "upload", "media_folder": "ebooks", "targets": ["-100123"], "watch": true},
+        {"name": "forward", "type": "forward", "sources": ["chan_d"], "targets": ["-100456"], "interval": 600},
+        {"name": "mirror", "type": "mirror", "channels": ["chan_a", "chan_d"], "interval": 900}
+      ]
+    }
+
+Job types:
+    ebooks   pdfscrapper.py: "channel" (single channel) or "channels" (crawler)
+    images   hello.py: "channel", optional "upload_targets"
+    upload   pdfuploader.py: "media_folder", "targets", "watch", "album"
+    forward  channel_forwarder.py: "sources", "targets", "resume" (default true),
+             "serve" to keep forwarding with sources and targets reloaded from "config"
+    mirror   history_mirror.py: "channels" to sync into the local metadata mirror
+
+ebooks, images and forward jobs with "takeout": true read history through
+a takeout session, which Telegram rate-limits less strictly for bulk reads.
+ebooks (single channel), images and forward jobs with "from_mirror": true
+plan from the local mirror instead of paging the channel history. With
+"dry_run": true they only save a transfer plan and report its size; with
+"from_plan": true they transfer exactly what the saved plan lists.
+
+A job with "interval" runs again that many seconds after it finishes;
+otherwise it runs once. A watching upload job or serving forward job runs
+until the process stops and keeps its job slot the whole time.
+"""
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from telethon import TelegramClient
+
+import channel_forwarder
+import hello
+import pdfscrapper
+import pdfuploader
+from batched_session import BatchedSQLiteSession
+from blocking_io import start_lag_monitor
+from dc_pool import get_pool
+from dialog_inventory import DialogInventory
+from entity_cache import EntityCache
+from history_mirror import HistoryMirror
+from rate_limiter import RateLimiter
+
+# Load environment variables
+load_dotenv()
+
+
+class Orchestrator:
+    def __init__(self, config: dict, once=False):
+        self.config = config
+        self.once = once
+        self.client = TelegramClient(
+            BatchedSQLiteSession(config.get('session', 'orchestrator_session')),
+            int(os.getenv('TELEGRAM_API_ID')),
+            os.getenv('TELEGRAM_API_HASH')
+        )
+        rate_limit = config.get('rate_limit', {})
+        self.rate_limiter = RateLimiter(rate_limit.get('requests', 30), rate_limit.get('window', 1))
+        self.entity_cache = EntityCache(self.client, DialogInventory())
+        self.mirror = HistoryMirror(self.client, rate_limiter=self.rate_limiter, entity_cache=self.entity_cache)
+        self.job_slots = asyncio.Semaphore(config.get('max_concurrent_jobs', 4))
+        self.runners = {
+            'ebooks': self.run_ebooks,
+            'images': self.run_images,
+            'upload': self.run_upload,
+            'forward': self.run_forward,
+            'mirror': self.run_mirror
+        }
+        # Each job's pipeline objects, so their pending saves can be flushed on shutdown
+        self.states = []
+
+    def shared(self) -> dict:
+        return {
+            'client': self.client,
+            'rate_limiter': self.rate_limiter,
+            'entity_cache': self.entity_cache
+        }
+
+    async def run_ebooks(self, job, state):
+        if 'downloader' not in state:
+            state['downloader'] = pdfscrapper.TelegramDownloader(**self.shared())
+            state['downloader'].takeout = job.get('takeout', state['downloader'].takeout)
+            await state['downloader'].initialize()
+        downloader = state['downloader']
+        if job.get('channels'):
+            state['crawler'] = pdfscrapper.ChannelCrawler(downloader, job['channels'])
+            await state['crawler'].crawl()
+        elif job.get('from_plan'):
+            await downloader.run_saved_plan(job.get('channel'))
+        else:
+            await downloader.download_media(
+                job.get('start_from'), channel_name=job.get('channel'), mirror=self.job_mirror(job),
+                dry_run=job.get('dry_run', False)
+            )
+
+    async def run_images(self, job, state):
+        if 'downloader' not in state:
+            state['downloader'] = hello.TelegramDownloader(**self.shared())
+            state['downloader'].takeout = job.get('takeout', state['downloader'].takeout)
+            if 'upload_targets' in job:
+                state['downloader'].target_channels = job['upload_targets']
+            await state['downloader'].initialize()
+        if job.get('from_plan'):
+            await state['downloader'].run_saved_plan(job.get('channel'))
+            return
+        await state['downloader'].download_media(
+            job.get('start_from'), channel_name=job.get('channel'), mirror=self.job_mirror(job),
+            dry_run=job.get('dry_run', False)
+        )
+
+    async def run_upload(self, job, state):
+        if 'uploader' not in state:
+            uploader = pdfuploader.TelegramUploader(**self.shared())
+            if 'targets' in job:
+                uploader.target_names = job['targets']
+            if 'media_folder' in job:
+                uploader.media_folder = Path(job['media_folder'])
+            await uploader.initialize_targets()
+            state['uploader'] = uploader
+        uploader = state['uploader']
+        if job.get('watch'):
+            await uploader.watch_folder()
+        else:
+            await uploader.start_upload(resume=job.get('resume', False), album=job.get('album', False))
+
+    async def run_forward(self, job, state):
+        if 'forwarder' not in state:
+            forwarder = channel_forwarder.TelegramForwarder(**self.shared())
+            forwarder.takeout = job.get('takeout', forwarder.takeout)
+            if 'sources' in job:
+                forwarder.source_channels = job['sources']
+            if 'targets' in job:
+                forwarder.target_channels = job['targets']
+            config = forwarder.read_config(job['config']) if 'config' in job else None
+            if config:
+                forwarder.source_channels, forwarder.target_channels = config
+            await forwarder.initialize_channels()
+            state['forwarder'] = forwarder
+        forwarder = state['forwarder']
+        if job.get('from_plan'):
+            await forwarder.run_saved_plans()
+            return
+        if job.get('serve'):
+            await forwarder.serve(job.get('config', channel_forwarder.CONFIG_FILE))
+            return
+        for source in forwarder.sources:
+            offset_id = forwarder.get_resume_offset(source) if job.get('resume', True) else 0
+            await forwarder.forward_messages(
+                source, offset_id=offset_id, mirror=self.job_mirror(job), dry_run=job.get('dry_run', False)
+            )
+
+    async def run_mirror(self, job, state):
+        await self.mirror.sync(job.get('channels', []))
+
+    def job_mirror(self, job):
+        return self.mirror if job.get('from_mirror') else None
+
+    async def run_job(self, job):
+        """Run one job, repeating it every ``interval`` seconds if set"""
+        name = job.get('name', job['type'])
+        runner = self.runners[job['type']]
+        state = {}
+        self.states.append(state)
+        while True:
+            async with self.job_slots:
+                print(f"\n▶ Starting job {name}")
+                try:
+                    await runner(job, state)
+                    print(f"✓ Job {name} finished")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"✗ Job {name} failed: {type(e).__name__}: {str(e)}")
+            if self.once or not job.get('interval'):
+                return
+            await asyncio.sleep(job['interval'])
+
+    @staticmethod
+    def savers(state) -> list:
+        """JsonSavers of a job's pipeline objects"""
+        savers = []
+        if 'downloader' in state:
+            savers.append(state['downloader'].file_index.saver)
+        if 'crawler' in state:
+            savers.append(state['crawler'].cursor_saver)
+        if 'uploader' in state:
+            savers.append(state['uploader'].history_saver)
+        if 'forwarder' in state:
+            state['forwarder'].save_history()
+            savers.append(state['forwarder'].history_saver)
+        return savers
+
+    async def run(self):
+        jobs = self.config.get('jobs', [])
+        unknown = [job['type'] for job in jobs if job.get('type') not in self.runners]
+        if unknown:
+            raise ValueError(f"Unknown job types: {', '.join(map(str, unknown))}")
+
+        await self.client.start()
+        get_pool(self.client).start()
+        try:
+            await asyncio.gather(*(self.run_job(job) for job in jobs))
+        finally:
+            for state in self.states:
+                for saver in self.savers(state):
+                    await saver.flush()
+            await self.client.disconnect()
+
+
+def load_config(path) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Run Telegram pipelines on one shared client')
+    parser.add_argument('--config', default='orchestrator.json', help='Path to the JSON job config')
+    parser.add_argument('--once', action='store_true', help='Run every job once, ignoring intervals')
+    args = parser.parse_args()
+
+    orchestrator = Orchestrator(load_config(args.config), once=args.once)
+    start_lag_monitor()
+    await orchestrator.run()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nOrchestrator interrupted by user")
@@ -1,11 +1,24 @@
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
 import os
 from dotenv import load_dotenv
 import asyncio
-import hashlib
+import json
+import re
+from collections import deque
 from datetime import datetime
 from humanize import naturalsize
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set, Tuple
+from batched_session import BatchedSQLiteSession
+from blocking_io import JsonSaver, ainput, run_blocking, start_lag_monitor
+from dc_pool import get_pool
+from file_index import FileIndex, hash_file
+from instrumentation import timed_iter, timer
+from spool import get_spool
+from history_reader import fetch_history_page, iter_history
+from takeout import BACKFILL_TAKEOUT, backfill_reader
+from transfer_plan import TransferPlan, requests_per_second
+from rate_limiter import RateLimiter
+from resumable_download import download_resumable
 
 # Load environment variables
 load_dotenv()
@@ -14,17 +27,27 @@ load_dotenv()
 api_id = int(os.getenv('TELEGRAM_API_ID'))
 api_hash = os.getenv('TELEGRAM_API_HASH')
 channel_username = os.getenv('TELEGRAM_CHANNEL_USERNAME')
+crawl_channels = os.getenv('TELEGRAM_CHANNEL_USERNAMES', '')
 
 # Rate limiting
 DELAY_BETWEEN_DOWNLOADS = 1
 MAX_DOWNLOADS_PER_MINUTE = 600
 MAX_DOWNLOADS_PER_HOUR = 30000
 
+# Multi-channel crawling
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+CRAWL_PAGE_SIZE = 100
+
 # Progress update interval (in seconds)
 PROGRESS_UPDATE_INTERVAL = 60  # Show progress every minute
 
 # Directory settings
 DOWNLOADS_DIR = 'ebooks'
+INDEX_FILE = 'ebook_index.json'
+CURSORS_FILE = 'crawl_cursors.json'
+CHANNELS_FILE = os.getenv('CRAWL_CHANNELS_FILE', 'ebook_channels.txt')
+# A numeric id, a username or a t.me link
+CHANNEL_PATTERN = re.compile(r'^(-?\d+|@?[A-Za-z]\w{3,31}|(https?://)?t\.me/\S+)$')
 
 # Supported e-book formats
 EBOOK_FORMATS = {
@@ -35,6 +58,11 @@ EBOOK_FORMATS = {
 }
 
 
+def message_key(message) -> Tuple[int, int]:
+    """(channel id, message id); message ids are only unique within a channel"""
+    return utils.get_peer_id(message.peer_id, add_mark=False), message.id
+
+
 class DownloadStats:
     def __init__(self):
         self.downloaded_files = 0
@@ -70,15 +98,26 @@ class DownloadStats:
         return "Starting download..."
 
 class TelegramDownloader:
-    def __init__(self):
-        self.client = TelegramClient('ebook_session', api_id, api_hash)
+    def __init__(self, client=None, rate_limiter=None, entity_cache=None):
+        self.client = client or TelegramClient(BatchedSQLiteSession('ebook_session'), api_id, api_hash)
+        self.rate_limiter = rate_limiter
+        # Shared by every crawler worker
+        self.download_limiter = RateLimiter(MAX_DOWNLOADS_PER_MINUTE, 60)
+        self.entity_cache = entity_cache
         self.stats = DownloadStats()
         self.existing_files: Dict[str, str] = {}
-        self.processed_ids: Set[int] = set()
+        # (channel id, message id) of every message already handled
+        self.processed_ids: Set[Tuple[int, int]] = set()
+        self.file_index = FileIndex(INDEX_FILE)
+        self.spool = get_spool()
+        self.dc_pool = get_pool(self.client)
+        # Read backfill history through a takeout session
+        self.takeout = BACKFILL_TAKEOUT
 
     async def initialize(self):
         await self.client.start()
-        self.existing_files, _, _ = self.get_existing_files()
+        self.dc_pool.start()
+        self.existing_files, _, _ = await run_blocking(self.get_existing_files)
 
     def get_existing_files(self):
         existing_files = {}
@@ -89,20 +128,25 @@ class TelegramDownloader:
         for filename in os.listdir(DOWNLOADS_DIR):
             if filename.lower().endswith(tuple(EBOOK_FORMATS.values())):
                 filepath = os.path.join(DOWNLOADS_DIR, filename)
-                file_hash = self.get_file_hash(filepath)
+                file_size = os.path.getsize(filepath)
+                file_hash = self.file_index.cached_hash(filename, file_size)
+                if file_hash:
+                    # Entries from before keys carried the channel only hold a bare message id
+                    self.processed_ids.update(
+                        tuple(key) for key in self.file_index.get(filename)['message_ids'] if isinstance(key, list)
+                    )
+                else:
+                    file_hash = self.get_file_hash(filepath)
+                    if file_hash:
+                        self.file_index.add(filename, file_size, self.strip_message_id(filename), file_hash, save=False)
                 if file_hash:
                     existing_files[file_hash] = filename
-                    total_size += os.path.getsize(filepath)
+                    total_size += file_size
                     file_count += 1
-                try:
-                    # Add validation for the message ID
-                    parts = filename.split('_')
-                    if len(parts) > 1:
-                        msg_id = int(parts[1].split('.')[0])
-                        if msg_id > 0:  # Only add valid positive message IDs
-                            self.processed_ids.add(msg_id)
-                except (ValueError, IndexError):
-                    continue  # Skip if we can't parse the ID
+                key = self.filename_key(filename)
+                if key:
+                    self.processed_ids.add(key)
+        self.file_index.save_index()
         return existing_files, total_size, file_count
 
     @staticmethod
@@ -110,8 +154,7 @@ class TelegramDownloader:
         if not os.path.exists(filepath):
             return None
         try:
-            with open(filepath, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+            return hash_file(filepath)
         except Exception as e:
             print(f"Error calculating hash for {filepath}: {str(e)}")
             return None
@@ -137,43 +180,88 @@ class TelegramDownloader:
         
         return False, None
 
-    async def process_single_message(self, message, minute_count, minute_start):
+    def wants_record(self, channel_id, record) -> bool:
+        """Whether a mirrored message looks like an e-book that is not indexed yet"""
+        if (channel_id, record['id']) in self.processed_ids or not record['document_id']:
+            return False
+        ext = EBOOK_FORMATS.get(record['mime_type']) or os.path.splitext(record['file_name'] or '')[1].lower()
+        if ext not in EBOOK_FORMATS.values():
+            return False
+        name = self.clean_name(record['file_name'] or f"ebook_{record['id']}{ext}")
+        return self.file_index.find(record['document_id'], record['size'], name) is None
+
+    async def process_single_message(self, message) -> Tuple[bool, int]:
+        """Download ``message``'s e-book if it needs one; returns whether it was tried and the bytes kept"""
         if not message or not hasattr(message, 'id'):
-            return minute_count, False
+            return False, 0
 
-        if message.id in self.processed_ids:
+        if message_key(message) in self.processed_ids:
             self.stats.skipped_files += 1
-            return minute_count, False
+            return False, 0
 
         is_ebook, ext = self.is_ebook(message)
         if not is_ebook:
-            return minute_count, False
+            return False, 0
 
-        minute_count = await self.handle_rate_limiting(minute_count, minute_start)
-        await self.download_ebook(message, ext)
-        return minute_count + 1, True
+        document = message.document
+        entry = self.file_index.find(document.id, document.size, self.get_safe_name(message, ext))
+        if entry:
+            self.file_index.add_alias(entry, list(message_key(message)), document.id)
+            self.processed_ids.add(message_key(message))
+            self.stats.skipped_files += 1
+            return False, 0
 
-    async def handle_rate_limiting(self, minute_count, minute_start):
-        if minute_count >= MAX_DOWNLOADS_PER_MINUTE:
-            current_time = datetime.now()
-            if (current_time - minute_start).total_seconds() < 60:
-                await asyncio.sleep(60 - (current_time - minute_start).total_seconds())
-            return 0
-        return minute_count
+        await self.download_limiter.wait()
+        if self.rate_limiter:
+            await self.rate_limiter.wait()
+        return True, await self.download_ebook(message, ext)
 
-    async def download_ebook(self, message, ext):
+    async def download_ebook(self, message, ext) -> int:
+        """Bytes written for ``message`` if its file was completed and kept, else 0"""
         filename = self.generate_filename(message, ext)
-        path = await self.client.download_media(
-            message.document,
-            file=os.path.join(DOWNLOADS_DIR, filename)
-        )
+        # Partial downloads stay next to their destination so they can resume;
+        # the spool only holds back the transfer while its quota is full
+        async with self.spool.reservation(message.document.size):
+            with timer('download_media', str(message.chat_id)):
+                path, file_hash, written = await download_resumable(
+                    self.client,
+                    message.document,
+                    os.path.join(DOWNLOADS_DIR, filename)
+                )
         
-        if path and os.path.exists(path):
-            self.update_stats(message, path)
-            print(f"Downloaded: {filename} ({naturalsize(os.path.getsize(path))})")
+        kept = 0
+        if path:
+            file_size = await run_blocking(os.path.getsize, path)
+            self.update_stats(message, file_size)
+            if await self.record_download(message, ext, path, file_hash, file_size):
+                print(f"Downloaded: {filename} ({naturalsize(file_size)})")
+                kept = written
         await asyncio.sleep(DELAY_BETWEEN_DOWNLOADS)
+        return kept
 
-    def generate_filename(self, message, ext):
+    async def record_download(self, message, ext, path, file_hash, file_size):
+        """Add a finished download to the index, dropping it if its content is already on disk"""
+        filename = os.path.basename(path)
+        duplicate = self.file_index.find_by_hash(file_hash) if file_hash else None
+        if duplicate and duplicate['filename'] != filename:
+            await run_blocking(os.remove, path)
+            self.file_index.add_alias(duplicate, list(message_key(message)), message.document.id)
+            print(f"Duplicate of {duplicate['filename']}: {filename} removed")
+            return False
+
+        self.file_index.add(
+            filename,
+            file_size,
+            self.get_safe_name(message, ext),
+            file_hash,
+            document_id=message.document.id,
+            message_id=list(message_key(message))
+        )
+        if file_hash:
+            self.existing_files[file_hash] = filename
+        return True
+
+    def get_safe_name(self, message, ext):
         original_name = ""
         for attr in message.document.attributes:
             if hasattr(attr, 'file_name'):
@@ -183,36 +271,108 @@ class TelegramDownloader:
         if not original_name:
             original_name = f"ebook_{message.id}{ext}"
 
-        safe_filename = "".join(c for c in original_name if c.isalnum() or c in (' ', '-', '_', '.'))
-        return f"{message.id}_{safe_filename}"
+        return self.clean_name(original_name)
+
+    @staticmethod
+    def clean_name(name):
+        return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_', '.'))
+
+    def generate_filename(self, message, ext):
+        channel_id, message_id = message_key(message)
+        return f"{channel_id}_{message_id}_{self.get_safe_name(message, ext)}"
 
-    def update_stats(self, message, path):
-        file_size = os.path.getsize(path)
+    @staticmethod
+    def filename_key(filename) -> Optional[Tuple[int, int]]:
+        """(channel id, message id) from a ``{channel}_{message}_{name}`` file name"""
+        parts = filename.split('_', 2)
+        if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+            return int(parts[0]), int(parts[1])
+        return None
+
+    @classmethod
+    def strip_message_id(cls, filename):
+        if cls.filename_key(filename):
+            return filename.split('_', 2)[2]
+        # Files from before names carried the channel id
+        prefix, sep, rest = filename.partition('_')
+        return rest if sep and prefix.isdigit() else filename
+
+    def update_stats(self, message, file_size):
         self.stats.total_size += file_size
         self.stats.downloaded_files += 1
         self.stats.files_since_last_update += 1
-        self.processed_ids.add(message.id)
+        self.processed_ids.add(message_key(message))
+
+    async def get_channel(self, name):
+        if self.entity_cache:
+            return await self.entity_cache.get(name)
+        return await self.client.get_entity(name)
+
+    async def plan_download(self, channel, start_from_msg_id=None, mirror=None) -> TransferPlan:
+        """Dry run: the e-books download_media would fetch, without fetching them"""
+        plan = TransferPlan(
+            'ebooks', channel.id, getattr(channel, 'title', None),
+            rate_limit=requests_per_second(self.rate_limiter),
+            delay_per_item=DELAY_BETWEEN_DOWNLOADS
+        )
+        await plan.scan(
+            self.client, channel, lambda record: self.wants_record(channel.id, record),
+            mirror, offset_id=start_from_msg_id, takeout=self.takeout
+        )
+        plan.save()
+        plan.print_report()
+        return plan
+
+    async def run_saved_plan(self, channel_name=None):
+        """Download what the last dry run for the channel planned"""
+        channel = await self.get_channel(channel_name or channel_username)
+        plan = TransferPlan.load('ebooks', channel.id)
+        if not plan:
+            print("No saved plan for this channel. Run a dry run first.")
+            return
+        await self.download_media(channel_name=channel_name, plan=plan)
+
+    async def download_media(self, start_from_msg_id=None, channel_name=None, mirror=None, dry_run=False, plan=None):
+        """Download e-books.
 
-    async def download_media(self, start_from_msg_id=None):
+        Plans from ``mirror`` (a HistoryMirror) if given. With ``dry_run``
+        only builds and saves a TransferPlan; with ``plan`` fetches exactly
+        the planned messages.
+        """
+        channel_name = channel_name or channel_username
         try:
-            channel = await self.client.get_entity(channel_username)
-            print(f"Connected to channel: {channel_username}")
+            channel = await self.get_channel(channel_name)
+            print(f"Connected to channel: {channel_name}")
+            if dry_run:
+                return await self.plan_download(channel, start_from_msg_id, mirror)
             print("Starting e-book download...")
             
-            minute_count = 0
-            minute_start = datetime.now()
             last_progress_update = datetime.now()
             self.stats.files_since_last_update = 0
 
-            message_iterator = self.client.iter_messages(
-                channel,
-                **({"offset_id": start_from_msg_id} if start_from_msg_id is not None else {})
-            )
+            if plan:
+                print(f"Running saved plan: {len(plan.items)} e-books")
+                message_iterator = iter_history(self.client, channel, self.takeout, ids=plan.ids)
+            elif mirror:
+                max_id = start_from_msg_id - 1 if start_from_msg_id else None
+                message_ids = mirror.channel(channel.id).pending_ids(
+                    lambda record: self.wants_record(channel.id, record), max_id=max_id
+                )[::-1]
+                print(f"Planned {len(message_ids)} e-books from the local mirror")
+                message_iterator = iter_history(self.client, channel, self.takeout, ids=message_ids)
+            else:
+                message_iterator = iter_history(
+                    self.client, channel, self.takeout,
+                    **({"offset_id": start_from_msg_id} if start_from_msg_id is not None else {})
+                )
 
-            async for message in message_iterator:
+            async for message in timed_iter(message_iterator, 'history_page', str(channel.id)):
+                # Messages deleted since they were mirrored come back as None
+                if message is None:
+                    continue
                 self.stats.last_message_id = message.id
                 try:
-                    minute_count, processed = await self.process_single_message(message, minute_count, minute_start)
+                    processed, _ = await self.process_single_message(message)
                     if processed and self.should_update_progress(last_progress_update):
                         print(self.stats.get_progress_string())
                         last_progress_update = datetime.now()
@@ -231,8 +391,226 @@ class TelegramDownloader:
     def should_update_progress(self, last_progress_update):
         return (datetime.now() - last_progress_update).total_seconds() >= PROGRESS_UPDATE_INTERVAL
 
+def load_channel_list(path) -> List[str]:
+    """Read channels from a file, one per line.
+
+    Also accepts the output of ``pdfuploader.py --list``, taking the id
+    column of its tab-separated lines (or the ``ID:`` line of each block in
+    older dumps). Anything that is not an id, username or t.me link, such
+    as headings and titles, is skipped.
+    """
+    if not os.path.exists(path):
+        return []
+
+    channels = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or set(line) == {'-'}:
+                continue
+            if '\t' in line:
+                line = line.split('\t')[1].strip()
+            elif line.startswith('ID:'):
+                line = line[3:].strip()
+            if CHANNEL_PATTERN.match(line):
+                channels.append(line)
+    return channels
+
+
+class ChannelCursor:
+    """Crawl position and counters for one channel.
+
+    The crawler first pages backwards from the newest message to the start
+    of the channel (``offset_id``), then pages forwards from ``newest_id``
+    to pick up messages posted since. ``prefetch`` fetches the page after
+    the one being scanned.
+    """
+
+    def __init__(self, name, state=None):
+        state = state or {}
+        self.name = name
+        self.entity = None
+        self.offset_id = state.get('offset_id', 0)
+        self.newest_id = state.get('newest_id', 0)
+        self.backfill_done = state.get('backfill_done', False)
+        self.scanned = state.get('scanned', 0)
+        self.total_messages = state.get('total_messages', 0)
+        self.prefetch: Optional[asyncio.Task] = None
+        self.run_scanned = 0
+        self.run_downloaded = 0
+        self.run_bytes = 0
+        self.active_seconds = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'offset_id': self.offset_id,
+            'newest_id': self.newest_id,
+            'backfill_done': self.backfill_done,
+            'scanned': self.scanned,
+            'total_messages': self.total_messages
+        }
+
+    @property
+    def backlog(self) -> int:
+        return max(self.total_messages - self.scanned, 0)
+
+    def get_report_line(self) -> str:
+        rate = self.run_scanned / self.active_seconds if self.active_seconds else 0
+        eta = f"{self.backlog / rate / 60:.0f}m" if rate and self.backlog else "-"
+        speed = self.run_bytes / self.active_seconds if self.active_seconds else 0
+        return (
+            f"{self.name}: {self.run_downloaded} e-books ({naturalsize(self.run_bytes)}, "
+            f"{naturalsize(speed)}/s), {rate:.1f} msgs/s, "
+            f"backlog ~{self.backlog} msgs, ETA {eta}"
+        )
+
+
+class ChannelCrawler:
+    """Crawl many channels with a round-robin scheduler.
+
+    Each turn takes the next channel off a queue, scans one page of its
+    history and puts it back at the end, so a channel never holds more than
+    one of the ``MAX_CONCURRENT_DOWNLOADS`` worker slots and a huge channel
+    can't starve the others.
+    """
+
+    def __init__(self, downloader: TelegramDownloader, channels: List[str]):
+        self.downloader = downloader
+        self.client = downloader.client
+        # History is read through here; a takeout session while crawling if enabled
+        self.reader = self.client
+        # Cursors of channels not in this crawl are written back unchanged
+        self.saved_cursors = self.load_cursors()
+        self.cursors = [ChannelCursor(name, self.saved_cursors.get(name)) for name in channels]
+        self.cursor_saver = JsonSaver(CURSORS_FILE, self.cursor_snapshot, stage='save_cursors', indent=2)
+        self.queue = deque()
+        self.last_progress_update = datetime.now()
+
+    def load_cursors(self) -> dict:
+        try:
+            if os.path.exists(CURSORS_FILE):
+                with open(CURSORS_FILE, 'r') as f:
+                    return json.load(f)
+            return {}
+        except Exception as e:
+            print(f"Error loading crawl cursors: {str(e)}")
+            return {}
+
+    def cursor_snapshot(self) -> dict:
+        return {**self.saved_cursors, **{cursor.name: cursor.to_dict() for cursor in self.cursors}}
+
+    def save_cursors(self):
+        """Save cursors off the event loop"""
+        self.cursor_saver.save()
+
+    async def resolve_channels(self):
+        for cursor in self.cursors:
+            try:
+                cursor.entity = await self.downloader.get_channel(cursor.name)
+                history = await self.reader.get_messages(cursor.entity, limit=0)
+                cursor.total_messages = history.total
+                self.queue.append(cursor)
+                print(f"✓ {cursor.name}: ~{cursor.backlog} messages left to scan")
+            except Exception as e:
+                print(f"✗ Skipping {cursor.name}: {str(e)}")
+
+    async def fetch_page(self, cursor: ChannelCursor, after=None):
+        """Fetch the page of history following ``after`` (or the cursor position), oldest-first when catching up"""
+        if not cursor.backfill_done:
+            offset_id = min(message.id for message in after) if after else cursor.offset_id
+            return await fetch_history_page(
+                self.reader, cursor.entity, limit=CRAWL_PAGE_SIZE, offset_id=offset_id
+            )
+        min_id = max([cursor.newest_id] + [message.id for message in after or []])
+        return await fetch_history_page(
+            self.reader, cursor.entity, limit=CRAWL_PAGE_SIZE, min_id=min_id, reverse=True
+        )
+
+    async def crawl_page(self, cursor: ChannelCursor) -> bool:
+        """Scan one page for ``cursor``; returns False once the channel has nothing left"""
+        started = datetime.now()
+        prefetch, cursor.prefetch = cursor.prefetch, None
+        with timer('history_page', cursor.name):
+            messages = await (prefetch or self.fetch_page(cursor))
+        if messages:
+            # Fetch the next page while this one downloads
+            cursor.prefetch = asyncio.create_task(self.fetch_page(cursor, messages))
+
+        for message in messages:
+            try:
+                processed, written = await self.downloader.process_single_message(message)
+                if processed:
+                    cursor.run_downloaded += 1
+                    cursor.run_bytes += written
+            except Exception as e:
+                print(f"Error downloading e-book from {cursor.name} message {message.id}: {str(e)}")
+                await asyncio.sleep(DELAY_BETWEEN_DOWNLOADS)
+
+        has_more = bool(messages)
+        if messages:
+            ids = [message.id for message in messages]
+            cursor.newest_id = max(cursor.newest_id, max(ids))
+            if not cursor.backfill_done:
+                cursor.offset_id = min(ids)
+            cursor.scanned += len(messages)
+            cursor.run_scanned += len(messages)
+        elif not cursor.backfill_done:
+            # Reached the start of the channel; catch up on new messages next turn
+            cursor.backfill_done = True
+            cursor.total_messages = cursor.scanned
+            has_more = True
+
+        cursor.active_seconds += (datetime.now() - started).total_seconds()
+        self.save_cursors()
+        return has_more
+
+    async def worker(self):
+        while self.queue:
+            cursor = self.queue.popleft()
+            try:
+                has_more = await self.crawl_page(cursor)
+            except Exception as e:
+                print(f"Error crawling {cursor.name}: {str(e)}")
+                has_more = False
+                if cursor.prefetch:
+                    cursor.prefetch.cancel()
+            if has_more:
+                self.queue.append(cursor)
+            if self.downloader.should_update_progress(self.last_progress_update):
+                self.print_report()
+                self.last_progress_update = datetime.now()
+
+    def print_report(self):
+        print("\n=== Crawl Progress ===")
+        for cursor in self.cursors:
+            if cursor.entity:
+                print(cursor.get_report_line())
+        print(self.downloader.stats.get_progress_string())
+
+    async def crawl(self):
+        async with backfill_reader(self.client, self.downloader.takeout) as reader:
+            self.reader = reader
+            try:
+                await self.resolve_channels()
+                if not self.queue:
+                    print("No channels to crawl.")
+                    return
+                print(f"Crawling {len(self.queue)} channels with {MAX_CONCURRENT_DOWNLOADS} workers...")
+                workers = min(MAX_CONCURRENT_DOWNLOADS, len(self.queue))
+                await asyncio.gather(*(self.worker() for _ in range(workers)))
+            finally:
+                for cursor in self.cursors:
+                    if cursor.prefetch:
+                        cursor.prefetch.cancel()
+                self.reader = self.client
+                await self.cursor_saver.flush()
+        print("\nCrawl Complete!")
+        self.print_report()
+
+
 async def main_menu():
     downloader = TelegramDownloader()
+    start_lag_monitor()
     await downloader.initialize()
 
     while True:
@@ -240,9 +618,12 @@ async def main_menu():
         print("1. Start new download")
         print("2. Resume from last message")
         print("3. Start from specific message ID")
-        print("4. Exit")
+        print("4. Crawl all configured channels")
+        print("5. Plan download (dry run)")
+        print("6. Run saved plan")
+        print("7. Exit")
         
-        choice = input("\nEnter your choice (1-4): ")
+        choice = await ainput("\nEnter your choice (1-7): ")
         
         if choice == '1':
             await downloader.download_media()
@@ -250,8 +631,9 @@ async def main_menu():
         elif choice == '2':
             if downloader.processed_ids:
                 try:
-                    # Filter out None values and find the maximum valid message ID
-                    valid_ids = [id for id in downloader.processed_ids if id is not None]
+                    # Message ids downloaded from the configured channel
+                    channel = await downloader.get_channel(channel_username)
+                    valid_ids = [msg_id for channel_id, msg_id in downloader.processed_ids if channel_id == channel.id]
                     if valid_ids:
                         last_id = max(valid_ids)
                         print(f"Resuming from message ID: {last_id}")
@@ -268,7 +650,7 @@ async def main_menu():
         
         elif choice == '3':
             try:
-                msg_id = int(input("Enter message ID to start from: "))
+                msg_id = int(await ainput("Enter message ID to start from: "))
                 if msg_id > 0:
                     await downloader.download_media(start_from_msg_id=msg_id)
                 else:
@@ -277,7 +659,21 @@ async def main_menu():
                 print("Invalid message ID. Please enter a number.")
         
         elif choice == '4':
+            channels = [ch.strip() for ch in crawl_channels.split(',') if ch.strip()] or load_channel_list(CHANNELS_FILE)
+            if channels:
+                await ChannelCrawler(downloader, channels).crawl()
+            else:
+                print(f"No channels found. Set TELEGRAM_CHANNEL_USERNAMES or list them in {CHANNELS_FILE}")
+        
+        elif choice == '5':
+            await downloader.download_media(dry_run=True)
+        
+        elif choice == '6':
+            await downloader.run_saved_plan()
+        
+        elif choice == '7':
             print("Exiting...")
+            await downloader.file_index.saver.flush()
             break
         
         else:
@@ -1,5 +1,6 @@
 import os
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from telethon.tl.types import Channel, Chat
 from dotenv import load_dotenv
 import asyncio
@@ -9,12 +10,33 @@ import time
 from humanize import naturalsize
 from pathlib import Path
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from batched_session import BatchedSQLiteSession
+from blocking_io import JsonSaver, run_blocking, start_lag_monitor
+from dialog_inventory import DialogInventory
+from file_index import HashCache, hash_file
+from rate_limiter import RateLimiter
+from upload_engine import UploadEngine
+from folder_watcher import FolderWatcher
 
 # Load environment variables
 load_dotenv()
 
+# Upload concurrency and per-target send budget
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '4'))
+MAX_UPLOADS_PER_TARGET = int(os.getenv('MAX_UPLOADS_PER_TARGET', '2'))
+TARGET_SENDS_PER_MINUTE = int(os.getenv('TARGET_SENDS_PER_MINUTE', '20'))
+
+# Content hashing runs in a thread pool ahead of the upload queue
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', '2'))
+
+# Album mode: Telegram allows up to 10 items of one kind per media group
+ALBUM_SIZE = 10
+# WebP is sent as a document; Telegram does not accept it as an album photo
+PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
 class TelegramUploader:
-    def __init__(self):
+    def __init__(self, client=None, rate_limiter=None, entity_cache=None):
         self.api_id = int(os.getenv('TELEGRAM_API_ID'))
         self.api_hash = os.getenv('TELEGRAM_API_HASH')
         self.target_names = os.getenv('TELEGRAM_TARGETS', '').split(',')
@@ -22,10 +44,30 @@ class TelegramUploader:
         
         self.media_folder = Path(os.getenv('MEDIA_FOLDER_PATH', 'media_files'))
         self.history_file = Path(os.getenv('HISTORY_FILE_PATH', 'upload_history.json'))
+        self.snapshot_file = Path(os.getenv('WATCH_SNAPSHOT_PATH', 'upload_snapshot.json'))
+        self.hash_cache = HashCache(os.getenv('HASH_CACHE_PATH', 'upload_hash_cache.json'))
+        self.hash_pool = ThreadPoolExecutor(HASH_WORKERS)
+        self.file_hashes = {}
+        # (target id, content hash) -> set once that upload has finished
+        self.in_flight = {}
         
-        self.client = TelegramClient('uploader_session', self.api_id, self.api_hash)
+        self.client = client or TelegramClient(BatchedSQLiteSession('uploader_session'), self.api_id, self.api_hash)
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
+        self.engine = UploadEngine(self.client)
+        self.inventory = DialogInventory()
         self.upload_history = self.load_history()
+        self.history_saver = JsonSaver(
+            self.history_file, lambda: {target: dict(uploads) for target, uploads in self.upload_history.items()}
+        )
         self.targets = []
+
+        self.upload_slots = asyncio.Semaphore(UPLOAD_WORKERS)
+        self.target_limiters = {}
+        self.target_queues = {}
+        self.queue_lag = {}
+        self.pending_targets = {}
+        self.watcher = None
         
         self.stats = {
             'uploaded': 0,
@@ -46,12 +88,16 @@ class TelegramUploader:
             return {}
 
     def save_history(self):
-        """Save upload history to file"""
-        self.history_file.parent.mkdir(parents=True, exist_ok=True)
-        self.history_file.write_text(json.dumps(self.upload_history))
+        """Save upload history to file, off the event loop"""
+        self.history_saver.save()
 
     async def _get_entity_from_name(self, target_name: str):
         """Helper to get entity from name or ID"""
+        if self.entity_cache:
+            return await self.entity_cache.get(target_name)
+        entity = await self.inventory.get_entity(self.client, target_name)
+        if entity:
+            return entity
         try:
             # If it's a numeric ID
             if str(target_name).replace('-', '').isdigit():
@@ -98,7 +144,7 @@ class TelegramUploader:
                 else:
                     print(f"✗ Skipped {target_name}: Not a channel or group")
             except Exception as e:
-                print(f"✗ Failed to add target {target_name}: {str(e)}")
+                print(f"✗ Failed to add target {target_name}: {str(e)}{self.inventory.suggest(target_name)}")
 
         self._print_target_summary()
 
@@ -111,32 +157,115 @@ class TelegramUploader:
         else:
             print("\nNo valid targets found. Please check your TELEGRAM_TARGETS in .env")
 
+    async def file_identity(self, filepath: Path):
+        """Return ``(content_hash, stat)`` for a file, hashing it in the pool on a cache miss"""
+        stat = await run_blocking(filepath.stat)
+        cached = self.file_hashes.get(filepath)
+        if cached and HashCache.key(cached[1]) == HashCache.key(stat):
+            return cached
+        file_hash = self.hash_cache.get(stat)
+        if file_hash is None:
+            loop = asyncio.get_running_loop()
+            file_hash = await loop.run_in_executor(self.hash_pool, hash_file, filepath)
+            self.hash_cache.set(stat, file_hash)
+        self.file_hashes[filepath] = (file_hash, stat)
+        return file_hash, stat
+
+    def _is_uploaded(self, target_id, file_hash, stat) -> bool:
+        """Check history by content hash, migrating a legacy size_mtime entry on the way"""
+        uploads = self.upload_history.get(target_id, {})
+        if file_hash in uploads:
+            return True
+        legacy_key = f"{stat.st_size}_{stat.st_mtime}"
+        if legacy_key in uploads:
+            uploads[file_hash] = uploads.pop(legacy_key)
+            self.save_history()
+            return True
+        return False
+
+    async def _wait_in_flight(self, target_id, hashes):
+        """Wait until no upload of the same content to this target is running"""
+        while True:
+            running = next(
+                (self.in_flight[(target_id, file_hash)] for file_hash in hashes if (target_id, file_hash) in self.in_flight),
+                None
+            )
+            if running is None:
+                return
+            await running.wait()
+
+    def _start_in_flight(self, target_id, hashes):
+        for file_hash in hashes:
+            self.in_flight[(target_id, file_hash)] = asyncio.Event()
+
+    def _finish_in_flight(self, target_id, hashes):
+        for file_hash in hashes:
+            done = self.in_flight.pop((target_id, file_hash), None)
+            if done:
+                done.set()
+
+    def _record_upload(self, target_id, filepath: Path, file_hash, stat):
+        """Add an upload to history and stats; the caller saves the history"""
+        if target_id not in self.upload_history:
+            self.upload_history[target_id] = {}
+
+        self.upload_history[target_id][file_hash] = {
+            'filename': filepath.name,
+            'timestamp': datetime.now().isoformat(),
+            'size': stat.st_size
+        }
+
+        self.stats['uploaded'] += 1
+        self.stats['total_size'] += stat.st_size
+        self.stats['last_file'] = filepath.name
+
+    def _record_failure(self, filepath: Path):
+        """Count a failed upload and keep the file from being marked processed"""
+        self.stats['failed'] += 1
+        if filepath in self.pending_targets:
+            self.pending_targets[filepath]['failed'] = True
+
+    async def _send(self, target, file, **kwargs):
+        """send_file within the target's rate limit, retrying once after a flood wait.
+
+        A global upload slot is only held while sending, not while waiting
+        on the target's limit or sleeping out a flood wait.
+        """
+        limiter = self.target_limiters.setdefault(str(target.id), RateLimiter(TARGET_SENDS_PER_MINUTE, 60))
+        await limiter.wait()
+        if self.rate_limiter:
+            await self.rate_limiter.wait()
+        try:
+            async with self.upload_slots:
+                return await self.engine.send_file(target, file, **kwargs)
+        except FloodWaitError as e:
+            print(f"Flood wait of {e.seconds}s for {target.title}")
+            await asyncio.sleep(e.seconds)
+        async with self.upload_slots:
+            return await self.engine.send_file(target, file, **kwargs)
+
     async def upload_file(self, filepath: Path, target) -> bool:
         """Upload a single file to a target"""
         target_id = str(target.id)
-        file_hash = f"{filepath.stat().st_size}_{filepath.stat().st_mtime}"
+        try:
+            file_hash, stat = await self.file_identity(filepath)
+        except OSError as e:
+            print(f"✗ Failed to read {filepath.name}: {e}")
+            self._record_failure(filepath)
+            return False
         
-        # Check if already uploaded
-        if target_id in self.upload_history and file_hash in self.upload_history[target_id]:
+        # A copy under another name may be uploading; its result decides whether this one is needed
+        await self._wait_in_flight(target_id, [file_hash])
+        if self._is_uploaded(target_id, file_hash, stat):
             self.stats['skipped'] += 1
             return False
 
+        self._start_in_flight(target_id, [file_hash])
         try:
-            await self.client.send_file(target, str(filepath))
+            await self._send(target, str(filepath))
             
             # Update history and stats
-            if target_id not in self.upload_history:
-                self.upload_history[target_id] = {}
-            
-            self.upload_history[target_id][file_hash] = {
-                'filename': filepath.name,
-                'timestamp': datetime.now().isoformat(),
-                'size': filepath.stat().st_size
-            }
-            
-            self.stats['uploaded'] += 1
-            self.stats['total_size'] += filepath.stat().st_size
-            self.stats['last_file'] = filepath.name
+            self._record_upload(target_id, filepath, file_hash, stat)
             self.save_history()
             
             print(f"✓ Uploaded {filepath.name} to {target.title}")
@@ -144,21 +273,95 @@ class TelegramUploader:
 
         except Exception as e:
             print(f"✗ Failed to upload {filepath.name} to {target.title}: {e}")
-            self.stats['failed'] += 1
+            self._record_failure(filepath)
             return False
+        finally:
+            self._finish_in_flight(target_id, [file_hash])
+
+    async def upload_album(self, files, target) -> bool:
+        """Upload up to 10 files of one kind to a target as a single media group"""
+        target_id = str(target.id)
+        identified = []
+        for filepath in files:
+            try:
+                identified.append((filepath, *await self.file_identity(filepath)))
+            except OSError as e:
+                print(f"✗ Failed to read {filepath.name}: {e}")
+                self._record_failure(filepath)
+
+        await self._wait_in_flight(target_id, [file_hash for _, file_hash, _ in identified])
+        pending = []
+        for filepath, file_hash, stat in identified:
+            if self._is_uploaded(target_id, file_hash, stat) or any(file_hash == h for _, h, _ in pending):
+                self.stats['skipped'] += 1
+            else:
+                pending.append((filepath, file_hash, stat))
+
+        if not pending:
+            return False
+        if len(pending) == 1:
+            return await self.upload_file(pending[0][0], target)
+
+        names = ', '.join(filepath.name for filepath, _, _ in pending)
+        self._start_in_flight(target_id, [file_hash for _, file_hash, _ in pending])
+        try:
+            await self._send(
+                target,
+                [str(filepath) for filepath, _, _ in pending],
+                force_document=not self.is_photo(pending[0][0])
+            )
+
+            # The whole group is recorded with a single history write
+            for filepath, file_hash, stat in pending:
+                self._record_upload(target_id, filepath, file_hash, stat)
+            self.save_history()
+
+            print(f"✓ Uploaded album of {len(pending)} files to {target.title}: {names}")
+            return True
+
+        except Exception as e:
+            print(f"✗ Failed to upload album to {target.title} ({names}): {e}")
+            for filepath, _, _ in pending:
+                self._record_failure(filepath)
+            return False
+        finally:
+            self._finish_in_flight(target_id, [file_hash for _, file_hash, _ in pending])
+
+    @staticmethod
+    def is_photo(filepath: Path) -> bool:
+        return filepath.suffix.lower() in PHOTO_EXTENSIONS
+
+    @classmethod
+    def group_albums(cls, files):
+        """Split files into runs of up to ALBUM_SIZE photos or ALBUM_SIZE documents"""
+        albums = []
+        for filepath in files:
+            if albums and len(albums[-1]) < ALBUM_SIZE and cls.is_photo(albums[-1][0]) == cls.is_photo(filepath):
+                albums[-1].append(filepath)
+            else:
+                albums.append([filepath])
+        return albums
 
     async def resume_upload(self):
         """Resume upload from last successful file"""
         files = sorted(self.media_folder.glob('*'))
-        if self.stats['last_file']:
+        last_file = self.stats['last_file'] or self._last_uploaded_file()
+        if last_file:
             try:
-                last_idx = [f.name for f in files].index(self.stats['last_file'])
+                last_idx = [f.name for f in files].index(last_file)
                 files = files[last_idx + 1:]
             except ValueError:
                 pass
         return files
 
-    async def start_upload(self, resume=False):
+    def _last_uploaded_file(self):
+        """Most recently uploaded filename according to the persisted history"""
+        entries = [entry for uploads in self.upload_history.values() for entry in uploads.values()]
+        if not entries:
+            return None
+        return max(entries, key=lambda entry: entry['timestamp'])['filename']
+
+    async def start_upload(self, resume=False, album=False):
         """Main upload function"""
         if not self.targets:
             print("No valid targets configured. Check TELEGRAM_TARGETS in .env")
@@ -172,21 +375,120 @@ class TelegramUploader:
 
         print(f"\nStarting upload of {len(files)} files to {len(self.targets)} targets")
         start_time = time.time()
-        last_update = time.time()
 
-        for file in files:
-            for target in self.targets:
-                await self.upload_file(file, target)
-                await asyncio.sleep(2)  # Rate limiting
-
-            # Progress update every 2 minutes
-            if time.time() - last_update >= 120:
-                self.print_progress(start_time)
-                last_update = time.time()
+        workers = self._start_workers(start_time)
+        batches = self.group_albums(files) if album else [[file] for file in files]
+        # Hash every batch at once, but queue them in file order so --resume can trust last_file
+        hashing = [asyncio.create_task(self._hash_batch(batch)) for batch in batches]
+        try:
+            for batch, task in zip(batches, hashing):
+                await task
+                self._enqueue_batch(batch)
+            await asyncio.gather(*(queue.join() for queue in self.target_queues.values()))
+        finally:
+            await self._cancel_tasks(hashing)
+            await self._cancel_tasks(workers)
+            self.hash_cache.save_cache()
 
         self.print_progress(start_time)
         print("\nUpload completed!")
 
+    async def watch_folder(self):
+        """Upload new or changed files as soon as they land in the media folder"""
+        if not self.targets:
+            print("No valid targets configured. Check TELEGRAM_TARGETS in .env")
+            return
+
+        start_time = time.time()
+        self.watcher = FolderWatcher(self.media_folder, self.snapshot_file)
+        workers = self._start_workers(start_time)
+        try:
+            async for filepath in self.watcher.watch():
+                await self._prepare_batch([filepath])
+                self.hash_cache.save_cache()
+        finally:
+            await self._cancel_tasks(workers)
+            self.print_progress(start_time)
+
+    def _start_workers(self, start_time):
+        """Create a queue per target plus its workers and the progress reporter"""
+        for target in self.targets:
+            self.target_queues[str(target.id)] = asyncio.Queue()
+        workers = [
+            asyncio.create_task(self._target_worker(target))
+            for target in self.targets
+            for _ in range(MAX_UPLOADS_PER_TARGET)
+        ]
+        workers.append(asyncio.create_task(self._report_progress(start_time)))
+        return workers
+
+    @staticmethod
+    async def _cancel_tasks(tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _hash_batch(self, batch):
+        """Hash a batch in the thread pool"""
+        for filepath in batch:
+            try:
+                await self.file_identity(filepath)
+            except OSError as e:
+                print(f"✗ Could not hash {filepath.name}: {e}")
+
+    async def _prepare_batch(self, batch):
+        """Hash a batch in the thread pool, then queue it for upload"""
+        await self._hash_batch(batch)
+        self._enqueue_batch(batch)
+
+    def _enqueue_batch(self, batch):
+        """Queue a single file, or an album of files, for every target"""
+        for filepath in batch:
+            pending = self.pending_targets.setdefault(filepath, {'left': 0, 'failed': False, 'stat': None})
+            pending['left'] += len(self.targets)
+            # The stat taken when the file was hashed, before any upload of it started
+            cached = self.file_hashes.get(filepath)
+            pending['stat'] = cached[1] if cached else None
+        for target in self.targets:
+            self.target_queues[str(target.id)].put_nowait((batch, time.time()))
+
+    def _target_done(self, batch, completed=True):
+        """Count down the targets left for each file and record it once every target has it"""
+        for filepath in batch:
+            pending = self.pending_targets[filepath]
+            pending['left'] -= 1
+            if not completed:
+                pending['failed'] = True
+            if pending['left'] == 0:
+                del self.pending_targets[filepath]
+                # A file that failed anywhere stays unprocessed so the next scan retries it
+                if self.watcher and not pending['failed'] and pending['stat']:
+                    self.watcher.mark_processed(filepath, pending['stat'])
+
+    async def _target_worker(self, target):
+        """Upload queued files to one target; sends share the global upload slots"""
+        target_id = str(target.id)
+        queue = self.target_queues[target_id]
+        while True:
+            batch, queued_at = await queue.get()
+            completed = False
+            try:
+                self.queue_lag[target_id] = time.time() - queued_at
+                if len(batch) == 1:
+                    await self.upload_file(batch[0], target)
+                else:
+                    await self.upload_album(batch, target)
+                completed = True
+            finally:
+                self._target_done(batch, completed)
+                queue.task_done()
+
+    async def _report_progress(self, start_time):
+        """Print progress every 2 minutes"""
+        while True:
+            await asyncio.sleep(120)
+            self.print_progress(start_time)
+
     def print_progress(self, start_time):
         elapsed = time.time() - start_time
         speed = self.stats['total_size'] / elapsed if elapsed > 0 else 0
@@ -196,34 +498,51 @@ class TelegramUploader:
         print(f"Files Skipped: {self.stats['skipped']}")
         print(f"Failed Uploads: {self.stats['failed']}")
         print(f"Total Size: {naturalsize(self.stats['total_size'])}")
-        print(f"Average Speed: {naturalsize(speed)}/s")
+        print(f"Average Speed: {naturalsize(speed)}/s ({speed / 1_000_000:.2f} MB/s)")
         print(f"Time Elapsed: {int(elapsed)}s")
         if self.stats['last_file']:
             print(f"Last File: {self.stats['last_file']}")
+        for target in self.targets:
+            target_id = str(target.id)
+            if target_id in self.target_queues:
+                print(f"  {target.title}: {self.target_queues[target_id].qsize()} queued, "
+                      f"lag {self.queue_lag.get(target_id, 0):.0f}s")
         print("=====================\n")
 
-    async def list_available_targets(self):
-        """List all available channels and groups"""
-        print("\nAvailable Channels and Groups:")
-        print("-" * 50)
-        
-        async for dialog in self.client.iter_dialogs():
-            if isinstance(dialog.entity, (Channel, Chat)):
-                entity_type = "Channel" if isinstance(dialog.entity, Channel) else "Group"
-                print(f"{entity_type}: {dialog.title}")
-                print(f"ID: {dialog.id}")
-                if hasattr(dialog.entity, 'username') and dialog.entity.username:
-                    print(f"Username: @{dialog.entity.username}")
-                print("-" * 50)
+    async def list_available_targets(self, full=False):
+        """List channels and groups from the dialog inventory, refreshing it first"""
+        await self.refresh_inventory(full)
+        print("\nAvailable Channels and Groups (type, id, username, title, members, last activity):")
+        for row in self.inventory.rows(types=('channel', 'megagroup', 'group')):
+            print(DialogInventory.format_row(row))
+
+    async def refresh_inventory(self, full=False):
+        count = await self.inventory.refresh(self.client, full=full or self.inventory.is_empty())
+        print(f"✓ Dialog inventory: {count} dialogs updated ({self.inventory.path})")
+
+    async def find_targets(self, query):
+        """Print the dialogs that best match ``query``"""
+        if self.inventory.is_empty():
+            await self.refresh_inventory()
+        matches = self.inventory.search(query, limit=10)
+        if not matches:
+            print(f"No dialogs match '{query}'")
+        for row in matches:
+            print(DialogInventory.format_row(row))
 
 async def main():
     parser = argparse.ArgumentParser(description='Telegram File Uploader')
     parser.add_argument('--resume', action='store_true', help='Resume from last upload')
     parser.add_argument('--status', action='store_true', help='Show current upload status')
     parser.add_argument('--list', action='store_true', help='List available channels and groups')
+    parser.add_argument('--full-refresh', action='store_true', help='Rebuild the dialog inventory when listing')
+    parser.add_argument('--find', metavar='NAME', help='Fuzzy search the dialog inventory by title or username')
+    parser.add_argument('--watch', action='store_true', help='Keep running and upload new files as they appear')
+    parser.add_argument('--album', action='store_true', help='Send up to 10 photos or documents per message as albums')
     args = parser.parse_args()
 
     uploader = TelegramUploader()
+    start_lag_monitor()
     
     try:
         await uploader.client.start()
@@ -232,14 +551,21 @@ async def main():
         if args.status:
             uploader.print_progress(time.time())
         elif args.list:
-            await uploader.list_available_targets()
+            await uploader.list_available_targets(full=args.full_refresh)
+            return
+        elif args.find:
+            await uploader.find_targets(args.find)
             return
+        elif args.watch:
+            await uploader.watch_folder()
         else:
-            await uploader.start_upload(resume=args.resume)
+            await uploader.start_upload(resume=args.resume, album=args.album)
             
     except KeyboardInterrupt:
         print("\nUpload interrupted by user")
     finally:
+        await uploader.history_saver.flush()
+        await run_blocking(uploader.hash_pool.shutdown)
         await uploader.client.disconnect()
 
 if __name__ == "__main__":
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Allow at most ``rate`` requests per ``window`` seconds.
+
+    Same fixed-window scheme as ``TelegramForwarder._wait_for_rate_limit``,
+    usable from any number of tasks.
+    """
+
+    def __init__(self, rate, window=1.0):
+        self.rate = rate
+        self.window = window
+        self.lock = asyncio.Lock()
+        self.window_start = time.monotonic()
+        self.requests_in_window = 0
+
+    async def wait(self):
+        async with self.lock:
+            elapsed = time.monotonic() - self.window_start
+            if elapsed >= self.window:
+                self.requests_in_window = 0
+                self.window_start = time.monotonic()
+            elif self.requests_in_window >= self.rate:
+                await asyncio.sleep(self.window - elapsed)
+                self.requests_in_window = 0
+                self.window_start = time.monotonic()
+            self.requests_in_window += 1
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+from bandwidth import get_shaper
+from blocking_io import run_blocking
+from dc_pool import get_pool
+
+# Telegram serves files in parts of at most 512 KB; each part is one chunk
+PART_SIZE = 512 * 1024
+PART_SUFFIX = '.part'
+SIDECAR_SUFFIX = '.part.json'
+
+
+class PartialDownload:
+    """A ``.part`` file plus an append-only JSON-lines sidecar.
+
+    The first sidecar line records the document's identity, every following
+    line records one completed part and its MD5, so a part is only counted
+    once it has been written out. The file is renamed to its final name
+    only after its size has been checked.
+
+    The whole-file MD5 is built up as parts are verified or arrive, so the
+    finished file never has to be read back to hash it.
+    """
+
+    def __init__(self, path, document, part_size=PART_SIZE):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.sidecar_path = path + SIDECAR_SUFFIX
+        self.document = document
+        self.part_size = part_size
+        self.identity = {
+            'document_id': document.id,
+            'size': document.size,
+            'part_size': part_size
+        }
+        self.file_hash = hashlib.md5()
+        # Bytes fetched by this run, not counting parts resumed from disk
+        self.written = 0
+
+    def load_parts(self) -> List[str]:
+        """Read completed part digests, or [] if the sidecar is missing or for another file"""
+        if not os.path.exists(self.sidecar_path) or not os.path.exists(self.part_path):
+            return []
+        parts = []
+        try:
+            with open(self.sidecar_path, 'r') as f:
+                if json.loads(f.readline()) != self.identity:
+                    return []
+                for line in f:
+                    try:
+                        parts.append(json.loads(line)['md5'])
+                    except (ValueError, KeyError):
+                        break  # Torn last line from an interrupted write
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable sidecar {self.sidecar_path}: {e}")
+            return []
+        return parts
+
+    def verify_parts(self, parts) -> List[str]:
+        """Return the leading parts whose data on disk matches their digest"""
+        verified = []
+        with open(self.part_path, 'rb') as f:
+            for digest in parts:
+                data = f.read(self.part_size)
+                if not data or hashlib.md5(data).hexdigest() != digest:
+                    break
+                verified.append(digest)
+                self.file_hash.update(data)
+        return verified
+
+    def reset(self, parts):
+        """Rewrite the .part file and sidecar to hold exactly ``parts``"""
+        offset = min(len(parts) * self.part_size, self.document.size)
+        with open(self.part_path, 'ab') as f:
+            f.truncate(offset)
+        with open(self.sidecar_path, 'w') as f:
+            f.write(json.dumps(self.identity) + '\n')
+            for digest in parts:
+                f.write(json.dumps({'md5': digest}) + '\n')
+        return offset
+
+    def write_part(self, part_file, sidecar, chunk):
+        """Append one part and record its digest once it is written out"""
+        part_file.write(chunk)
+        part_file.flush()
+        self.file_hash.update(chunk)
+        sidecar.write(json.dumps({'md5': hashlib.md5(chunk).hexdigest()}) + '\n')
+        sidecar.flush()
+
+    def finish(self):
+        os.replace(self.part_path, self.path)
+        os.remove(self.sidecar_path)
+
+    async def run(self, client) -> Tuple[Optional[str], Optional[str], int]:
+        parts = await run_blocking(self.load_parts)
+        if parts:
+            parts = await run_blocking(self.verify_parts, parts)
+        offset = await run_blocking(self.reset, parts)
+        if offset:
+            print(f"Resuming {os.path.basename(self.path)} from {offset} bytes")
+
+        shaper = get_shaper()
+        first_byte = get_pool(client).first_byte_progress(self.document)
+        with open(self.part_path, 'r+b') as part_file, open(self.sidecar_path, 'a') as sidecar:
+            part_file.seek(offset)
+            async for chunk in client.iter_download(
+                self.document,
+                offset=offset,
+                request_size=self.part_size,
+                file_size=self.document.size
+            ):
+                first_byte(offset + len(chunk), self.document.size)
+                await run_blocking(self.write_part, part_file, sidecar, chunk)
+                offset += len(chunk)
+                self.written += len(chunk)
+                await shaper.download(len(chunk))
+
+        if offset != self.document.size:
+            print(f"Incomplete download of {os.path.basename(self.path)}: "
+                  f"{offset} of {self.document.size} bytes, keeping .part to resume")
+            return None, None, self.written
+
+        await run_blocking(self.finish)
+        return self.path, self.file_hash.hexdigest(), self.written
+
+
+async def download_resumable(
+    client, document, path, part_size=PART_SIZE
+) -> Tuple[Optional[str], Optional[str], int]:
+    """Download ``document`` to ``path`` through a resumable ``.part`` file.
+
+    Returns the final path, the file's MD5 and the bytes fetched by this
+    call; path and MD5 are None if the transfer ended early.
+    """
+    return await PartialDownload(path, document, part_size).run(client)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+from blocking_io import run_blocking
+
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'temp')
+SPOOL_QUOTA = int(os.getenv('SPOOL_QUOTA_MB', '4096')) * 1024 * 1024
+# Caches of derived files that may be evicted, least recently used first
+CACHE_FOLDERS = [folder.strip() for folder in os.getenv('SPOOL_CACHE_FOLDERS', 'whatsapp_cache').split(',') if folder.strip()]
+# temp_<message id> files the forwarder used to leave in the working directory, with the
+# extension Telethon gave the download
+LEGACY_TEMP_FILE = re.compile(
+    r'^temp_\d+(\.(jpe?g|png|gif|webp|bmp|heic|mp4|mov|mkv|webm|avi|mp3|m4a|ogg|oga|opus|wav|flac|'
+    r'pdf|epub|mobi|azw3|djvu|fb2|txt|doc|docx|zip|rar|7z|tgs|bin))?$',
+    re.IGNORECASE
+)
+PART_SUFFIX = '.part'
+SIDECAR_SUFFIX = '.part.json'
+
+
+def pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Spool:
+    """Byte-quota staging area for media on its way somewhere else.
+
+    Each process stages under ``SPOOL_DIR/<pid>/``, one directory per
+    staged download, removed when the transfer is done. Callers reserve the
+    bytes they are about to write; when the quota is full the least recently
+    used files in ``CACHE_FOLDERS`` are evicted, and if that is not enough
+    the caller waits until other transfers release their reservations.
+    ``cleanup`` removes what crashed processes left behind.
+    """
+
+    def __init__(self, folder=SPOOL_DIR, quota=SPOOL_QUOTA, cache_folders=CACHE_FOLDERS):
+        self.folder = Path(folder)
+        self.quota = quota
+        self.cache_folders = [Path(folder) for folder in cache_folders]
+        self.process_folder = self.folder / str(os.getpid())
+        self.reserved = 0
+        self.in_flight = 0
+        self.cache_bytes: Optional[int] = None
+        self.condition = asyncio.Condition()
+
+    @staticmethod
+    def _remove(path: Path):
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _is_resumable(path: Path) -> bool:
+        """A partial download that ``resumable_download`` can still pick up"""
+        if path.name.endswith(SIDECAR_SUFFIX):
+            return path.with_name(path.name[:-len(SIDECAR_SUFFIX)] + PART_SUFFIX).exists()
+        return path.name.endswith(PART_SUFFIX) and path.with_name(path.name + '.json').exists()
+
+    def cleanup(self, legacy_folder='.') -> int:
+        """Remove staging files of processes that are no longer running"""
+        removed = 0
+        if self.folder.exists():
+            for path in self.folder.iterdir():
+                # Nothing is staged yet, so a folder under our own pid was left by an
+                # earlier process that had it, e.g. pid 1 before a container restart
+                if path.is_dir() and path.name.isdigit() and int(path.name) != os.getpid() and pid_alive(int(path.name)):
+                    continue
+                if self._is_resumable(path):
+                    continue
+                self._remove(path)
+                removed += 1
+        for path in Path(legacy_folder).iterdir():
+            if path.is_file() and LEGACY_TEMP_FILE.match(path.name) and not self._is_resumable(path):
+                path.unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            print(f"✓ Removed {removed} leftover staging files")
+        return removed
+
+    def _cache_files(self) -> List[os.DirEntry]:
+        files = []
+        for folder in self.cache_folders:
+            if folder.exists():
+                with os.scandir(folder) as entries:
+                    files.extend(entry for entry in entries if entry.is_file())
+        return files
+
+    def _count_cache(self) -> int:
+        return sum(entry.stat().st_size for entry in self._cache_files())
+
+    def evict(self, needed) -> int:
+        """Delete least recently used cache files until ``needed`` bytes are free"""
+        freed = 0
+        files = sorted(self._cache_files(), key=lambda entry: max(entry.stat().st_atime, entry.stat().st_mtime))
+        for entry in files:
+            if freed >= needed:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            freed += size
+        # Other processes may have written to the caches since the last count
+        self.cache_bytes = None
+        return freed
+
+    async def reserve(self, size):
+        """Wait until ``size`` more bytes fit in the quota, then claim them"""
+        size = size or 0
+        async with self.condition:
+            while True:
+                # Counting and evicting cache files walks the disk, so it runs in the pool
+                if self.cache_bytes is None:
+                    self.cache_bytes = await run_blocking(self._count_cache)
+                overflow = self.reserved + self.cache_bytes + size - self.quota
+                if overflow <= 0:
+                    break
+                if await run_blocking(self.evict, overflow):
+                    continue
+                # A file larger than the whole quota still goes through on its own
+                if not self.in_flight:
+                    break
+                print(f"Spool full ({self.reserved // (1024 * 1024)} MB staged), waiting...")
+                await self.condition.wait()
+            self.reserved += size
+            self.in_flight += 1
+
+    async def release(self, size):
+        async with self.condition:
+            self.reserved -= size or 0
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def reservation(self, size):
+        """Hold ``size`` bytes of quota for a transfer that writes elsewhere"""
+        await self.reserve(size)
+        try:
+            yield
+        finally:
+            await self.release(size)
+
+    @contextmanager
+    def directory(self):
+        """Yield a fresh staging directory, removed afterwards; holds no quota"""
+        self.process_folder.mkdir(parents=True, exist_ok=True)
+        path = Path(tempfile.mkdtemp(dir=self.process_folder))
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    @asynccontextmanager
+    async def stage(self, size):
+        """Reserve ``size`` bytes and yield a fresh directory, removed afterwards"""
+        async with self.reservation(size):
+            with self.directory() as path:
+                yield path
+
+
+_spool: Optional[Spool] = None
+
+
+def get_spool() -> Spool:
+    """The process-wide spool, cleaned up on first use"""
+    global _spool
+    if _spool is None:
+        _spool = Spool()
+        _spool.cleanup()
+    return _spool
@@ -0,0 +1,74 @@
+"""Takeout sessions for bulk history reads.
+
+Telegram applies more relaxed flood limits to requests wrapped in a data
+export ("takeout") session. Backfills can read history through one by
+setting ``BACKFILL_TAKEOUT=1`` (or a pipeline's ``takeout`` attribute);
+sends keep going through the normal client. Telethon sends file parts
+on their own senders, outside the takeout wrapper, so media downloads are
+not affected either way.
+
+The first takeout of an account may have to be allowed from another
+Telegram app; until then reads fall back to normal requests.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from telethon.errors import RPCError, TakeoutInitDelayError
+
+BACKFILL_TAKEOUT = os.getenv('BACKFILL_TAKEOUT', '') not in ('', '0')
+
+# A session holds one takeout at a time; concurrent backfills share it
+_sessions: Dict[int, list] = {}
+_lock = asyncio.Lock()
+
+
+async def _acquire(client):
+    async with _lock:
+        entry = _sessions.get(id(client))
+        if entry:
+            entry[2] += 1
+            return entry[1]
+        manager = client.takeout(finalize=True, chats=True, megagroups=True, channels=True)
+        try:
+            takeout = await manager.__aenter__()
+        except TakeoutInitDelayError as e:
+            print(f"✗ Takeout must be allowed from another Telegram app or after {e.seconds}s; "
+                  f"reading history with normal requests")
+            return None
+        except (RPCError, ValueError) as e:
+            print(f"✗ Could not open a takeout session ({e}); reading history with normal requests")
+            return None
+        print("✓ Takeout session opened for history reads")
+        _sessions[id(client)] = [manager, takeout, 1]
+        return takeout
+
+
+async def _release(client):
+    async with _lock:
+        entry = _sessions[id(client)]
+        entry[2] -= 1
+        if entry[2]:
+            return
+        del _sessions[id(client)]
+        try:
+            await entry[0].__aexit__(None, None, None)
+        except (RPCError, ValueError) as e:
+            print(f"Error finishing takeout session: {e}")
+
+
+@asynccontextmanager
+async def backfill_reader(client, enabled=None):
+    """Client to read history through: a takeout session if ``enabled``, else ``client`` itself"""
+    if enabled is None:
+        enabled = BACKFILL_TAKEOUT
+    takeout = await _acquire(client) if enabled else None
+    if takeout is None:
+        yield client
+        return
+    try:
+        yield takeout
+    finally:
+        await _release(client)
+
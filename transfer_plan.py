@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from humanize import naturaldelta, naturalsize
+
+from history_reader import HistoryReader
+from instrumentation import timed_iter
+from message_meta import message_record
+from takeout import backfill_reader
+
+PLAN_DIR = Path(os.getenv('PLAN_DIR', 'plans'))
+# Throughput assumed for the wall-time estimate, in MB/s
+PLAN_DOWNLOAD_MBPS = float(os.getenv('PLAN_DOWNLOAD_MBPS', '5'))
+PLAN_UPLOAD_MBPS = float(os.getenv('PLAN_UPLOAD_MBPS', '2'))
+HISTORY_PAGE_SIZE = 100
+FILE_PART_SIZE = 512 * 1024
+DEFAULT_RATE_LIMIT = 30.0
+
+
+class TransferPlan:
+    """What a download or forward run would transfer, found without transferring.
+
+    Built by a dry run from history metadata after the usual skip and dedup
+    checks, saved to ``PLAN_DIR`` and handed back to the real run, which
+    then fetches exactly the planned ids instead of paging history again.
+    ``targets`` is how many chats each item is sent to (0 for plain
+    downloads) and ``copies`` how many times each item is downloaded and
+    uploaded; ``rate_limit`` (requests per second) and ``delay_per_item``
+    (fixed sleeps per item) come from the caller's configured limits.
+    """
+
+    def __init__(self, kind, channel_id, channel_name=None, targets=0, copies=1,
+                 rate_limit=DEFAULT_RATE_LIMIT, delay_per_item=0.0):
+        self.kind = kind
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.targets = targets
+        self.copies = copies
+        self.rate_limit = rate_limit
+        self.delay_per_item = delay_per_item
+        self.items: List[dict] = []
+        self.scanned = 0
+        self.skipped = 0
+        # How long the history scan took and where it read from: mirror, takeout or requests
+        self.scan_seconds = 0.0
+        self.history_source = None
+        self.created_at = datetime.now().isoformat()
+
+    @property
+    def ids(self) -> List[int]:
+        return [item['id'] for item in self.items]
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(item['size'] or 0 for item in self.items)
+
+    def add(self, record):
+        self.items.append({'id': record['id'], 'media': record['media'], 'size': record['size']})
+
+    async def scan(self, client, channel, wanted, mirror=None, limit=None, offset_id=None, takeout=None):
+        """Add the history records ``wanted(record)`` accepts, timing the scan"""
+        started = time.monotonic()
+        async with backfill_reader(client, False if mirror else takeout) as reader:
+            if mirror:
+                self.history_source = 'local mirror'
+            else:
+                self.history_source = 'takeout session' if reader is not client else 'normal requests'
+            async for record in iter_records(reader, channel, mirror, limit=limit, offset_id=offset_id):
+                self.scanned += 1
+                if wanted(record):
+                    self.add(record)
+                else:
+                    self.skipped += 1
+        self.scan_seconds = time.monotonic() - started
+
+    def bytes_by_type(self) -> dict:
+        totals = defaultdict(lambda: {'count': 0, 'bytes': 0})
+        for item in self.items:
+            totals[item['media'] or 'text']['count'] += 1
+            totals[item['media'] or 'text']['bytes'] += item['size'] or 0
+        return dict(totals)
+
+    def estimate_rpcs(self) -> dict:
+        parts = sum(math.ceil((item['size'] or 0) / FILE_PART_SIZE) for item in self.items) * self.copies
+        return {
+            # The real run fetches planned ids in batches of 100
+            'history': math.ceil(len(self.items) / HISTORY_PAGE_SIZE),
+            'download': parts,
+            'upload': parts if self.targets else 0,
+            'send': len(self.items) * self.targets
+        }
+
+    def estimate_seconds(self) -> float:
+        rate_bound = sum(self.estimate_rpcs().values()) / self.rate_limit
+        transfer = self.total_bytes * self.copies / (PLAN_DOWNLOAD_MBPS * 1_000_000)
+        if self.targets:
+            transfer += self.total_bytes * self.copies / (PLAN_UPLOAD_MBPS * 1_000_000)
+        return max(rate_bound, transfer + len(self.items) * self.delay_per_item)
+
+    def print_report(self):
+        print(f"\n=== Plan: {self.kind} from {self.channel_name or self.channel_id} ===")
+        print(f"Scanned: {self.scanned} messages, skipped {self.skipped}, planned {len(self.items)}")
+        if self.scan_seconds:
+            print(f"History scan: {self.scan_seconds:.1f}s, {self.scanned / self.scan_seconds:.0f} msgs/s "
+                  f"({self.history_source})")
+        for media, totals in sorted(self.bytes_by_type().items()):
+            print(f"  {media}: {totals['count']} ({naturalsize(totals['bytes'])})")
+        print(f"Total media: {naturalsize(self.total_bytes)}")
+        rpcs = self.estimate_rpcs()
+        print(f"Expected requests: {sum(rpcs.values())} ({', '.join(f'{kind} {count}' for kind, count in rpcs.items())})")
+        print(f"Estimated time: {naturaldelta(self.estimate_seconds())} "
+              f"(at {self.rate_limit:g} req/s, {PLAN_DOWNLOAD_MBPS:g} MB/s down, {PLAN_UPLOAD_MBPS:g} MB/s up)")
+
+    def to_dict(self) -> dict:
+        return {
+            'kind': self.kind,
+            'channel_id': self.channel_id,
+            'channel_name': self.channel_name,
+            'targets': self.targets,
+            'copies': self.copies,
+            'rate_limit': self.rate_limit,
+            'delay_per_item': self.delay_per_item,
+            'created_at': self.created_at,
+            'scanned': self.scanned,
+            'skipped': self.skipped,
+            'scan_seconds': round(self.scan_seconds, 3),
+            'history_source': self.history_source,
+            'estimate': {'rpcs': self.estimate_rpcs(), 'seconds': round(self.estimate_seconds())},
+            'items': self.items
+        }
+
+    @staticmethod
+    def path_for(kind, channel_id) -> Path:
+        return PLAN_DIR / f"{kind}_{channel_id}.json"
+
+    def save(self) -> Path:
+        """Atomically write the plan to ``PLAN_DIR``"""
+        path = self.path_for(self.kind, self.channel_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_name(path.name + '.tmp')
+        tmp_file.write_text(json.dumps(self.to_dict(), indent=2))
+        os.replace(tmp_file, path)
+        print(f"✓ Plan saved to {path}")
+        return path
+
+    @classmethod
+    def load(cls, kind, channel_id) -> Optional['TransferPlan']:
+        """The saved plan for ``kind`` and channel, or None if there is none"""
+        path = cls.path_for(kind, channel_id)
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text())
+        plan = cls(
+            data['kind'], data['channel_id'], data.get('channel_name'),
+            data.get('targets', 0), data.get('copies', 1),
+            data.get('rate_limit', DEFAULT_RATE_LIMIT), data.get('delay_per_item', 0.0)
+        )
+        plan.items = data['items']
+        plan.scanned = data.get('scanned', 0)
+        plan.skipped = data.get('skipped', 0)
+        plan.scan_seconds = data.get('scan_seconds', 0.0)
+        plan.history_source = data.get('history_source')
+        plan.created_at = data.get('created_at', plan.created_at)
+        return plan
+
+
+def requests_per_second(rate_limiter) -> float:
+    """Request rate allowed by a shared ``RateLimiter``, or the default"""
+    if rate_limiter:
+        return rate_limiter.rate / rate_limiter.window
+    return DEFAULT_RATE_LIMIT
+
+
+async def iter_records(client, channel, mirror=None, limit=None, offset_id=None):
+    """Message metadata newest-first, from ``mirror`` if given, else from the server"""
+    if mirror:
+        max_id = offset_id - 1 if offset_id else None
+        records = list(mirror.channel(channel.id).records(max_id=max_id))[::-1][:limit]
+        for record in records:
+            yield record
+        return
+    messages = HistoryReader(client, channel, limit=limit, offset_id=offset_id)
+    async for message in timed_iter(messages, 'history_page', str(channel.id)):
+        yield message_record(message)
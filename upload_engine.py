@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+from telethon import utils
+from telethon.errors import FilePartMissingError, FilePartsInvalidError
+from telethon.tl import functions, types
+
+from bandwidth import get_shaper
+from blocking_io import run_blocking
+from instrumentation import timer
+
+# Telegram accepts part sizes that divide 512 KB
+PART_SIZES_KB = (32, 64, 128, 256, 512)
+BIG_FILE_SIZE = 10 * 1024 * 1024
+MAX_PARTS_IN_FLIGHT = int(os.getenv('UPLOAD_PARTS_IN_FLIGHT', '8'))
+RTT_REFRESH_INTERVAL = 300
+# Uploaded handles are valid for less than a day; reuse them for an hour
+HANDLE_TTL = 3600
+METRICS_FILE = os.getenv('UPLOAD_METRICS_FILE', 'upload_metrics.jsonl')
+
+
+class UploadEngine:
+    """Upload files with tuned part sizes and several parts in flight.
+
+    Part size and the number of parts in flight are chosen from the file
+    size and the measured round-trip time to Telegram, and every part is
+    charged to the shared egress bandwidth limit. Every upload reports
+    progress and MB/s through an optional callback and is appended to
+    ``METRICS_FILE`` as one JSON line, so the tuning can be checked against
+    benchmark runs. A handle is cached per file so sending the same file to
+    several targets uploads it once.
+    """
+
+    def __init__(self, client, metrics_file=METRICS_FILE, max_parts_in_flight=MAX_PARTS_IN_FLIGHT):
+        self.client = client
+        self.metrics_file = metrics_file
+        self.max_parts_in_flight = max_parts_in_flight
+        self.shaper = get_shaper()
+        self.rtt = None
+        self.rtt_measured_at = 0
+        self.handles = {}
+        self.uploading = {}
+
+    async def measure_rtt(self) -> float:
+        """Round-trip time of a ping, refreshed every few minutes"""
+        if self.rtt is None or time.monotonic() - self.rtt_measured_at > RTT_REFRESH_INTERVAL:
+            started = time.monotonic()
+            await self.client(functions.PingRequest(ping_id=random.randrange(-2**63, 2**63)))
+            self.rtt = time.monotonic() - started
+            self.rtt_measured_at = time.monotonic()
+        return self.rtt
+
+    @staticmethod
+    def choose_part_size(file_size, rtt) -> int:
+        """Part size in bytes: larger for large files and high-latency links"""
+        index = PART_SIZES_KB.index(utils.get_appropriated_part_size(file_size))
+        if file_size < 1024 * 1024:
+            index = 1
+        if rtt > 0.15:
+            index += 1
+        return PART_SIZES_KB[min(index, len(PART_SIZES_KB) - 1)] * 1024
+
+    def choose_parts_in_flight(self, part_count, rtt) -> int:
+        """Enough parts in flight to cover the round trip, at least two"""
+        wanted = max(2, int(rtt / 0.05) + 1)
+        return max(1, min(wanted, self.max_parts_in_flight, part_count))
+
+    async def upload(self, path, progress_callback=None):
+        """Upload ``path`` and return an InputFile or InputFileBig handle"""
+        key = (path, await run_blocking(os.path.getmtime, path))
+        cached = self.handles.get(key)
+        if cached and time.monotonic() - cached[1] < HANDLE_TTL:
+            return cached[0]
+        # Another target is already uploading this file; share its handle
+        if key in self.uploading:
+            return await asyncio.shield(self.uploading[key])
+
+        task = asyncio.ensure_future(self._upload(path, key, progress_callback))
+        self.uploading[key] = task
+        task.add_done_callback(lambda _: self.uploading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _upload(self, path, key, progress_callback):
+        file_size = await run_blocking(os.path.getsize, path)
+        rtt = await self.measure_rtt()
+        part_size = self.choose_part_size(file_size, rtt)
+        part_count = max(1, (file_size + part_size - 1) // part_size)
+        in_flight = self.choose_parts_in_flight(part_count, rtt)
+        is_big = file_size > BIG_FILE_SIZE
+        file_id = random.randrange(-2**63, 2**63)
+        md5 = hashlib.md5()
+        slots = asyncio.Semaphore(in_flight)
+        sent = 0
+        started = time.monotonic()
+
+        async def send_part(index, data):
+            nonlocal sent
+            try:
+                if is_big:
+                    request = functions.upload.SaveBigFilePartRequest(file_id, index, part_count, data)
+                else:
+                    request = functions.upload.SaveFilePartRequest(file_id, index, data)
+                if not await self.client(request):
+                    raise RuntimeError(f"Failed to upload part {index} of {path}")
+                sent += len(data)
+                if progress_callback:
+                    elapsed = time.monotonic() - started
+                    result = progress_callback(sent, file_size, sent / elapsed if elapsed else 0)
+                    if inspect.isawaitable(result):
+                        await result
+            finally:
+                slots.release()
+
+        def read_part(f):
+            data = f.read(part_size)
+            if not is_big:
+                md5.update(data)
+            return data
+
+        failures = []
+
+        def part_done(task):
+            if not task.cancelled() and task.exception():
+                failures.append(task.exception())
+
+        tasks = []
+        try:
+            with open(path, 'rb') as f:
+                for index in range(part_count):
+                    await slots.acquire()
+                    # Stop reading and sending as soon as a part has failed
+                    if failures:
+                        slots.release()
+                        raise failures[0]
+                    data = await run_blocking(read_part, f)
+                    await self.shaper.upload(len(data))
+                    task = asyncio.create_task(send_part(index, data))
+                    task.add_done_callback(part_done)
+                    tasks.append(task)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        seconds = time.monotonic() - started
+        await run_blocking(self.log_result, path, file_size, part_size, in_flight, rtt, seconds)
+
+        name = os.path.basename(path)
+        if is_big:
+            handle = types.InputFileBig(file_id, part_count, name)
+        else:
+            handle = types.InputFile(file_id, part_count, name, md5.hexdigest())
+        self.handles[key] = (handle, time.monotonic())
+        return handle
+
+    async def send_file(self, entity, file, progress_callback=None, **kwargs):
+        """``client.send_file`` for one path or a list of paths, uploading through the engine"""
+        with timer('send_file', str(getattr(entity, 'id', entity))):
+            return await self._send_file(entity, file, progress_callback, **kwargs)
+
+    async def _send_file(self, entity, file, progress_callback, **kwargs):
+        paths = file if isinstance(file, (list, tuple)) else [file]
+        # Photos go through Telethon so they are resized to Telegram's limits
+        if not kwargs.get('force_document') and any(utils.is_image(path) for path in paths):
+            return await self._send_photos(entity, file, paths, progress_callback, **kwargs)
+
+        handles = [await self.upload(path, progress_callback) for path in paths]
+        try:
+            return await self.client.send_file(entity, handles if len(handles) > 1 else handles[0], **kwargs)
+        except (FilePartMissingError, FilePartsInvalidError):
+            # The server dropped a cached upload; upload again and retry once
+            for path in paths:
+                self.handles.pop((path, await run_blocking(os.path.getmtime, path)), None)
+            handles = [await self.upload(path, progress_callback) for path in paths]
+            return await self.client.send_file(entity, handles if len(handles) > 1 else handles[0], **kwargs)
+
+    async def _send_photos(self, entity, file, paths, progress_callback, **kwargs):
+        started = time.monotonic()
+        shaped = self.shaper.upload_progress()
+        sizes = [await run_blocking(os.path.getsize, path) for path in paths]
+        file_size = sum(sizes)
+
+        def album_bytes(position):
+            # Telethon reports album progress in files, a fraction into the current one
+            index = min(int(position), len(sizes))
+            partial = sizes[index] * (position - index) if index < len(sizes) else 0
+            return int(sum(sizes[:index]) + partial)
+
+        async def report(current, total):
+            if len(paths) > 1:
+                current, total = album_bytes(current), file_size
+            await shaped(current, total)
+            if progress_callback:
+                elapsed = time.monotonic() - started
+                result = progress_callback(current, total, current / elapsed if elapsed else 0)
+                if inspect.isawaitable(result):
+                    await result
+
+        result = await self.client.send_file(entity, file, progress_callback=report, **kwargs)
+        part_size = utils.get_appropriated_part_size(file_size) * 1024
+        name = paths[0] if len(paths) == 1 else f"album of {len(paths)} photos"
+        await run_blocking(self.log_result, name, file_size, part_size, 1, self.rtt or 0, time.monotonic() - started)
+        return result
+
+    def log_result(self, path, file_size, part_size, in_flight, rtt, seconds):
+        mbps = file_size / seconds / 1_000_000 if seconds else 0
+        print(f"Uploaded {os.path.basename(path)}: {mbps:.2f} MB/s "
+              f"({part_size // 1024} KB parts, {in_flight} in flight, RTT {rtt * 1000:.0f} ms)")
+        try:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps({
+                    'timestamp': datetime.now().isoformat(),
+                    'file': os.path.basename(path),
+                    'size': file_size,
+                    'part_size': part_size,
+                    'parts_in_flight': in_flight,
+                    'rtt': round(rtt, 4),
+                    'seconds': round(seconds, 3),
+                    'mb_per_s': round(mbps, 3)
+                }) + '\n')
+        except OSError as e:
+            print(f"Error writing upload metrics: {e}")
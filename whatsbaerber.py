@@ -1,9 +1,20 @@
-import pywhatkit as kit
+import abc
 import time
 import datetime
+import json
 import os
+import shutil
 import signal
 import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from file_index import hash_file
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 # List of WhatsApp group names
 whatsapp_groups = [
@@ -26,13 +37,134 @@ photos_folder = "/home/deetech/Documents/nextks/fastapi/allscrapper/downloads"
 # Log file to keep track of sent files
 log_file = "sent_files.log"
 
+# Persisted queue of scheduled sends
+jobs_file = "whatsapp_jobs.json"
+
+# Send backend: "pywhatkit" drives WhatsApp Web, "local" copies into an outbox folder
+transport_name = os.getenv("WHATSAPP_TRANSPORT", "pywhatkit")
+outbox_folder = os.getenv("WHATSAPP_OUTBOX", "whatsapp_outbox")
+
+# Pacing: pause after each send in proportion to how long the send took,
+# backing off after failures
+MIN_SEND_GAP = 1.0
+SEND_GAP_FACTOR = 0.25
+MAX_SEND_GAP = 120.0
+# A failed send goes back to the end of the queue until it has been tried this often
+MAX_SEND_ATTEMPTS = 3
+
+# WhatsApp-optimized copies, prepared in a process pool ahead of the sends
+prepared_folder = os.getenv("WHATSAPP_CACHE", "whatsapp_cache")
+MAX_IMAGE_SIDE = 1600
+TARGET_IMAGE_BYTES = 300 * 1024
+PREPARE_WORKERS = os.cpu_count() or 2
+
+
+class Transport(abc.ABC):
+    """Sends a photo to a WhatsApp group; raises on failure"""
+
+    @abc.abstractmethod
+    def send_image(self, group_name, photo_path):
+        ...
+
+
+class PywhatkitTransport(Transport):
+    def __init__(self):
+        # Imported here so the local transport works without a browser session
+        import pywhatkit
+        self.kit = pywhatkit
+
+    def send_image(self, group_name, photo_path):
+        self.kit.sendwhats_image(group_name, photo_path)
+
+
+class LocalTransport(Transport):
+    """Stand-in backend that copies photos into ``outbox/<group>/``"""
+
+    def __init__(self, outbox=outbox_folder):
+        self.outbox = outbox
+
+    def send_image(self, group_name, photo_path):
+        group_folder = os.path.join(self.outbox, group_name)
+        os.makedirs(group_folder, exist_ok=True)
+        shutil.copy2(photo_path, group_folder)
+
+
+def get_transport(name=transport_name):
+    transports = {"pywhatkit": PywhatkitTransport, "local": LocalTransport}
+    if name not in transports:
+        raise ValueError(f"Unknown WhatsApp transport: {name}")
+    return transports[name]()
+
 # Function to send photo to a WhatsApp group
-def send_photo_to_whatsapp_group(group_name, photo_path):
+def send_photo_to_whatsapp_group(transport, group_name, photo_path):
     try:
-        kit.sendwhats_image(group_name, photo_path)
-        time.sleep(5)  # Wait a bit after sending to avoid rate limits
+        transport.send_image(group_name, photo_path)
+        return True
     except Exception as e:
         print(f"Error sending photo to {group_name}: {str(e)}")
+        return False
+
+# Function to make a downscaled, metadata-free JPEG copy of a photo
+def prepare_photo(photo_path, cache_folder=prepared_folder):
+    """Return a WhatsApp-sized copy of ``photo_path``, cached by content hash.
+
+    Runs in a worker process. GIFs, and everything when Pillow is not
+    installed, are sent as they are.
+    """
+    if Image is None or photo_path.lower().endswith('.gif'):
+        return photo_path
+
+    content_hash = hash_file(photo_path)
+    prepared_path = os.path.join(cache_folder, f"{content_hash}.jpg")
+    # Empty marker left when the recompressed copy was no smaller than the original
+    original_marker = os.path.join(cache_folder, f"{content_hash}.original")
+    for cached in (prepared_path, original_marker):
+        if os.path.exists(cached):
+            # Mark as recently used so the spool evicts it last
+            os.utime(cached)
+            return prepared_path if cached == prepared_path else photo_path
+
+    os.makedirs(cache_folder, exist_ok=True)
+    # A unique name, so workers preparing the same photo do not write over each other
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_folder)
+    os.close(fd)
+    try:
+        with Image.open(photo_path) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+            # Saving without exif/info drops the metadata
+            for quality in (85, 75, 65, 55):
+                image.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+                if os.path.getsize(tmp_path) <= TARGET_IMAGE_BYTES:
+                    break
+        if os.path.getsize(tmp_path) >= os.path.getsize(photo_path):
+            open(original_marker, 'w').close()
+            return photo_path
+        os.replace(tmp_path, prepared_path)
+        return prepared_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def start_preparing(jobs, pool):
+    """Submit every pending job's photo to the pool; returns futures by photo"""
+    return {
+        job['photo']: pool.submit(prepare_photo, job['photo'])
+        for job in jobs
+        if job['status'] == 'pending'
+    }
+
+def get_prepared_photo(prepared, photo_path):
+    future = prepared.get(photo_path)
+    if future is None:
+        return photo_path
+    try:
+        prepared_path = future.result()
+    except Exception as e:
+        print(f"Could not prepare {photo_path}, sending original: {str(e)}")
+        return photo_path
+    # The spool may have evicted the cached copy since it was made
+    return prepared_path if os.path.exists(prepared_path) else photo_path
 
 # Function to get user input for the time in 12-hour format
 def get_user_input_time():
@@ -66,27 +198,99 @@ def signal_handler(sig, frame):
     print("\nGracefully shutting down...")
     sys.exit(0)
 
-def wait_with_progress(delay):
-    start_time = time.time()
+def wait_until(deadline):
+    """Sleep until ``deadline``, waking at most once a minute to show the time left"""
     try:
+        waited = False
         while True:
-            elapsed = time.time() - start_time
-            remaining = delay - elapsed
-            
+            remaining = (deadline - datetime.datetime.now()).total_seconds()
             if remaining <= 0:
                 break
-                
             print(f"\rWaiting to send photos... Time remaining: {format_time_remaining(remaining)}", end='', flush=True)
-            time.sleep(1)
-        print("\nStarting to send photos...")
+            time.sleep(min(remaining, 60))
+            waited = True
+        if waited:
+            print("\nStarting to send photos...")
     except KeyboardInterrupt:
         print("\nOperation cancelled by user")
         sys.exit(0)
 
+# Functions to load and save the job queue
+def load_jobs():
+    if not os.path.exists(jobs_file):
+        return []
+    with open(jobs_file, 'r') as f:
+        return json.load(f)
+
+def save_jobs(jobs):
+    tmp_file = jobs_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(jobs, f, indent=2)
+    os.replace(tmp_file, jobs_file)
+
+def build_jobs(groups, photos, sent_files, due_time):
+    """Give each group the next unsent photo, all due at ``due_time``"""
+    unsent = iter(photo for photo in photos if photo not in sent_files)
+    jobs = []
+    for group, photo in zip(groups, unsent):
+        jobs.append({
+            'group': group,
+            'photo': photo,
+            'due': due_time.isoformat(),
+            'status': 'pending'
+        })
+    return jobs
+
+def run_jobs(jobs, transport, sent_files, prepared=None):
+    """Send due jobs in order, pacing by how long each send actually took.
+
+    A failed send is retried after the other jobs, up to MAX_SEND_ATTEMPTS
+    tries, before it is marked failed.
+    """
+    gap = MIN_SEND_GAP
+    queue = deque(job for job in jobs if job['status'] == 'pending')
+    while queue:
+        job = queue.popleft()
+        wait_until(datetime.datetime.fromisoformat(job['due']))
+
+        photo = get_prepared_photo(prepared or {}, job['photo'])
+        print(f"\nSending photo to {job['group']} ({os.path.getsize(photo) // 1024} KB)...")
+        started = time.monotonic()
+        if send_photo_to_whatsapp_group(transport, job['group'], photo):
+            duration = time.monotonic() - started
+            job['status'] = 'sent'
+            log_sent_file(job['photo'])
+            sent_files.add(job['photo'])
+            gap = max(MIN_SEND_GAP, duration * SEND_GAP_FACTOR)
+            print(f"Sent in {duration:.1f}s")
+        else:
+            job['attempts'] = job.get('attempts', 0) + 1
+            if job['attempts'] < MAX_SEND_ATTEMPTS:
+                # Still pending, so an interrupted run retries it too
+                queue.append(job)
+                print(f"Will retry {job['group']} (attempt {job['attempts']} of {MAX_SEND_ATTEMPTS} failed)")
+            else:
+                job['status'] = 'failed'
+            gap = min(gap * 2, MAX_SEND_GAP)
+        save_jobs(jobs)
+        if queue:
+            time.sleep(gap)
+
 # Main function
 def main():
     signal.signal(signal.SIGINT, signal_handler)
-    
+    transport = get_transport()
+    if Image is None:
+        print("Pillow is not installed; photos are sent without resizing or recompression")
+    sent_files = load_sent_files()
+    pool = ProcessPoolExecutor(PREPARE_WORKERS)
+
+    # Finish jobs left over from an interrupted run first
+    jobs = load_jobs()
+    if any(job['status'] == 'pending' for job in jobs):
+        print(f"Resuming {sum(job['status'] == 'pending' for job in jobs)} pending sends")
+        run_jobs(jobs, transport, sent_files, start_preparing(jobs, pool))
+
     time_hour, time_min = get_user_input_time()
 
     # Calculate the delay to the specified time
@@ -103,41 +307,33 @@ def main():
     confirm = input("Do you want to continue? (y/n): ").lower()
     if confirm != 'y':
         print("Operation cancelled")
+        pool.shutdown()
         return
 
-    # Wait with progress bar
-    wait_with_progress(delay)
-
-    # Load sent files from the log
-    sent_files = load_sent_files()
-
     # Get list of photos in the folder
     photos = [os.path.join(photos_folder, f) for f in os.listdir(photos_folder) 
              if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp'))]
 
     if not photos:
         print("No photos found in the specified folder!")
+        pool.shutdown()
         return
 
     print(f"Found {len(photos)} photos to send")
-    
-    # Send photos to groups in batches of 5
-    batch_size = 5
-    for i in range(0, len(whatsapp_groups), batch_size):
-        batch = whatsapp_groups[i:i + batch_size]
-        for group in batch:
-            for photo in photos:
-                if photo not in sent_files:
-                    print(f"\nSending photo to {group}...")
-                    send_photo_to_whatsapp_group(group, photo)
-                    log_sent_file(photo)
-                    sent_files.add(photo)
-                    time.sleep(10)  # Wait for 10 seconds between messages
-                    break  # Move to the next group after sending one photo
-        print("\nWaiting 60 seconds before next batch...")
-        time.sleep(60)  # Wait between batches
-
-    print("\nAll photos sent successfully.")
+
+    # Queue one unsent photo per group, persisted so a restart can resume
+    jobs = build_jobs(whatsapp_groups, photos, sent_files, scheduled_time)
+    save_jobs(jobs)
+    # Photos are prepared while we wait for the scheduled time
+    prepared = start_preparing(jobs, pool)
+    run_jobs(jobs, transport, sent_files, prepared)
+    pool.shutdown()
+
+    failed = sum(job['status'] == 'failed' for job in jobs)
+    if failed:
+        print(f"\n{failed} sends failed; see {jobs_file}")
+    else:
+        print("\nAll photos sent successfully.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file